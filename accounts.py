@@ -1,3 +1,5 @@
+from money import to_cents, round_cents
+
 class Account:
     """
     A class to represent a bank Account. Accounts all initialize with zero balance.
@@ -6,7 +8,8 @@ class Account:
         owner (int): Customer number of the person who owns the account
         acct_number (int): Account number
         type (str): Account type - either 'savings' or 'checking'
-        balance (num): Balance in the account
+        balance (num): Balance in the account, in dollars
+        balance_cents (int): Balance in the account, in cents. This is what the account actually holds
         interest_rate (num): Interest rate on the account, in percent. Cannot be zero for a savings account
 
     Methods:
@@ -14,6 +17,8 @@ class Account:
         withdraw: Deduct an amount from the balance. Balance cannot go negative
         pay_interest: Apply interest to the balance
     """
+    __slots__ = ('owner', 'acct_number', '_type', '_balance', '_interest_rate')
+
     def __init__(self, owner, acct_number, acct_type, interest_rate = 0):
         """
         Creates a new Account of the specified type and interest rate.
@@ -37,6 +42,21 @@ class Account:
         self._balance = 0
         self._interest_rate = interest_rate
 
+    @classmethod
+    def from_row(cls, row):
+        """
+        Builds an Account from values already stored in the database, skipping the validation in __init__.
+
+        Args:
+            row (tuple): account number, owner, type, balance in cents and interest rate, in the order of the accounts table
+
+        Returns:
+            the Account
+        """
+        acct = cls.__new__(cls)
+        acct.acct_number, acct.owner, acct._type, acct._balance, acct._interest_rate = row
+        return acct
+
     def __repr__(self):
         base_repr = f'{self.type} account nbr {self.acct_number} has balance ${round(self.balance, 2)}'
         if self.interest_rate != 0:
@@ -45,7 +65,12 @@ class Account:
 
     @property
     def balance(self):
-        """Balance in this account"""
+        """Balance in this account, in dollars"""
+        return self._balance / 100
+
+    @property
+    def balance_cents(self):
+        """Balance in this account, in cents"""
         return self._balance
 
     @property
@@ -71,10 +96,11 @@ class Account:
         Raises:
             ValueError: attempted to deposit negative amount
         """
-        if amount < 0:
+        cents = to_cents(amount)
+        if cents < 0:
             raise ValueError("Negative deposit not allowed")
-        self._balance += amount
-        return self._balance
+        self._balance += cents
+        return self.balance
 
     def withdraw(self, amount):
         """
@@ -89,21 +115,31 @@ class Account:
         Raises:
             ValueError: balance would be negative, or attempted to withdraw negative amount
         """
-        if amount > self._balance:
+        cents = to_cents(amount)
+        if cents > self._balance:
             raise ValueError("Insufficient funds to make this withdrawal")
-        if amount < 0:
+        if cents < 0:
             raise ValueError("Negative withdrawal not allowed")
-        self._balance -= amount
-        return self._balance
+        self._balance -= cents
+        return self.balance
+
+    def sync_balance(self, cents):
+        """
+        Sets the balance to what the database holds, after a change was applied there
+
+        Args:
+            cents (int): the stored balance, in cents
+        """
+        self._balance = cents
 
     def pay_interest(self):
         """
-        Applies monthly interest to the account. The rate is the annual rate / 12
+        Applies monthly interest to the account. The rate is the annual rate / 12, and the result is rounded to the cent
 
         Returns:
             the account balance after applying interest
         """
         multiplier = 1 + self._interest_rate / 1200.0
-        self._balance *= multiplier
-        return self._balance
+        self._balance = round_cents(self._balance * multiplier)
+        return self.balance
         
\ No newline at end of file
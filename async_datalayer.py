@@ -0,0 +1,110 @@
+"""
+Asyncio counterparts of the datalayer functions, for serving many customer sessions from one event loop.
+Each call runs the blocking datalayer function on a dedicated thread pool, with its own pooled connection,
+so a slow SQLite call never stalls the event loop.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import functools
+import datalayer as dl
+from bankpersons import Employee, Customer
+from accounts import Account
+from services import CreditCard, Loan
+
+_executor = ThreadPoolExecutor(max_workers=10, thread_name_prefix="datalayer")
+
+def configure_executor(max_workers):
+    """
+    Replaces the thread pool the async functions run on. Keep max_workers within
+    the engine's pool_size + max_overflow, or calls will queue for a connection anyway.
+
+    Arguments:
+        max_workers(int): Number of datalayer calls that can run at once
+    """
+    global _executor
+    old_executor = _executor
+    _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="datalayer")
+    old_executor.shutdown(wait=False)
+
+async def _run(func, *args, **kwargs):
+    """Runs a blocking datalayer function on the thread pool, and waits for its result"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+async def employee_upsert(emp:Employee):
+    """See datalayer.employee_upsert"""
+    return await _run(dl.employee_upsert, emp)
+
+async def employee_srch(emp_id = None, first_name = None, last_name = None):
+    """See datalayer.employee_srch"""
+    return await _run(dl.employee_srch, emp_id, first_name, last_name)
+
+async def customer_upsert(cust:Customer):
+    """See datalayer.customer_upsert"""
+    return await _run(dl.customer_upsert, cust)
+
+async def customer_srch(cust_id = None, first_name = None, last_name = None):
+    """See datalayer.customer_srch"""
+    return await _run(dl.customer_srch, cust_id, first_name, last_name)
+
+async def account_upsert(acct:Account):
+    """See datalayer.account_upsert"""
+    return await _run(dl.account_upsert, acct)
+
+async def account_srch(acct_num = None, cust_num = None):
+    """See datalayer.account_srch"""
+    return await _run(dl.account_srch, acct_num, cust_num)
+
+async def credit_card_upsert(card:CreditCard):
+    """See datalayer.credit_card_upsert"""
+    return await _run(dl.credit_card_upsert, card)
+
+async def credit_card_srch(acct_num = None, cust_num = None):
+    """See datalayer.credit_card_srch"""
+    return await _run(dl.credit_card_srch, acct_num, cust_num)
+
+async def loan_upsert(loan:Loan):
+    """See datalayer.loan_upsert"""
+    return await _run(dl.loan_upsert, loan)
+
+async def loan_srch(acct_num = None, cust_num = None):
+    """See datalayer.loan_srch"""
+    return await _run(dl.loan_srch, acct_num, cust_num)
+
+async def transfer(from_acct:Account, to_acct:Account, amount):
+    """See datalayer.transfer"""
+    return await _run(dl.transfer, from_acct, to_acct, amount)
+
+async def account_deposit(acct:Account, amount):
+    """See datalayer.account_deposit"""
+    return await _run(dl.account_deposit, acct, amount)
+
+async def account_withdraw(acct:Account, amount):
+    """See datalayer.account_withdraw"""
+    return await _run(dl.account_withdraw, acct, amount)
+
+async def credit_card_charge(card:CreditCard, amount):
+    """See datalayer.credit_card_charge"""
+    return await _run(dl.credit_card_charge, card, amount)
+
+async def apply_payment(acct:Account, svc, amount):
+    """See datalayer.apply_payment"""
+    return await _run(dl.apply_payment, acct, svc, amount)
+
+async def as_of_balance(acct_num, ts):
+    """See datalayer.as_of_balance"""
+    return await _run(dl.as_of_balance, acct_num, ts)
+
+async def month_end_interest(period = None, batch_size = dl.BULK_BATCH_SIZE):
+    """See datalayer.month_end_interest"""
+    return await _run(dl.month_end_interest, period, batch_size)
+
+async def load_accts(cust:Customer):
+    """
+    Loads all accounts and services for the specified Customer, running the three searches concurrently.
+    Always prefetches: a lazy load would run its queries on the event loop the first time they are used.
+    """
+    cust.accounts, cards, loans = await asyncio.gather(account_srch(cust_num=cust.cust_number),
+                                                       credit_card_srch(cust_num=cust.cust_number),
+                                                       loan_srch(cust_num=cust.cust_number))
+    cust.services = cards + loans
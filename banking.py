@@ -0,0 +1,279 @@
+# Service layer for the simple banking system
+# Every customer and employee action as a plain function, with no prompts or printing,
+# so the system can be driven programmatically, batched, or load tested.
+# The interactive interfaces are thin wrappers over these functions.
+#
+# Actions raise ValueError when they are refused (bad amount, insufficient funds, over the limit);
+# nothing is saved in that case. Successful balance changes return the ledger Transaction they recorded.
+# Balance changes are applied relative to the balance stored in the database, never by saving the
+# in-memory object, so a change made elsewhere in the meantime (another session, month-end) is kept.
+# The objects passed in are then brought up to date with the stored balance.
+
+from collections import namedtuple
+from random import randint, random
+from datalayer import *
+from money import to_cents
+import ledger
+import logging
+import metrics
+
+# the two ledger entries recorded by a card/loan payment
+Payment = namedtuple('Payment', ['account', 'service'])
+
+def _new_acct_number():
+    """A random 10 digit account number"""
+    return randint(1000000000, 9999999999)
+
+@metrics.timed('banking')
+def find_customer(first_name, last_name):
+    """
+    Looks up a customer by name, with their accounts and services loaded.
+
+    Arguments:
+        first_name(str): the customer's first name
+        last_name(str): the customer's last name
+
+    Returns:
+        the Customer (the first one, if several share the name), or None if there is no such customer
+    """
+    cust = customer_srch(first_name=first_name, last_name=last_name)
+    if not cust:
+        return None
+    if isinstance(cust, list):
+        cust = cust[0]
+    load_accts(cust)
+    return cust
+
+@metrics.timed('banking')
+def register_customer(first_name, last_name, address, city, state, zipcode, email):
+    """
+    Sets up and saves a new customer.
+
+    Returns:
+        the new Customer, with its customer number assigned
+    """
+    cust = Customer(first_name, last_name, None)
+    cust.add_contact(address, city, state, zipcode, email)
+    customer_upsert(cust)
+    logging.info(f"Created new {cust}")
+    return cust
+
+@metrics.timed('banking')
+def open_account(cust:Customer, acct_type, deposit, interest_rate = None):
+    """
+    Opens a new checking or savings Account for a customer, with an opening deposit.
+
+    Arguments:
+        cust(Customer): the customer opening the account
+        acct_type(str): 'checking' or 'savings'
+        deposit(num): the opening deposit, in dollars
+        interest_rate(num): interest rate in percent. Defaults to 0 for checking, and the bank's offered rate for savings
+
+    Returns:
+        the new Account
+
+    Raises:
+        ValueError: acct_type is not valid, or the deposit is negative
+    """
+    if interest_rate is None:
+        interest_rate = random() * 3 if acct_type.lower() == 'savings' else 0
+    new_account = Account(cust.cust_number, _new_acct_number(), acct_type, interest_rate)
+    new_account.deposit(deposit)
+    cust.open_account(new_account)
+    account_upsert(new_account)
+    ledger.record(new_account.acct_number, 'deposit', new_account.balance_cents, new_account.balance_cents)
+    logging.info(f"{cust} opened new {new_account}")
+    return new_account
+
+@metrics.timed('banking')
+def deposit(cust:Customer, acct:Account, amount):
+    """
+    Deposits an amount into one of a customer's accounts.
+
+    Arguments:
+        cust(Customer): the customer making the deposit
+        acct(Account): the account to deposit into
+        amount(num): the amount, in dollars
+
+    Returns:
+        the ledger Transaction for the deposit
+
+    Raises:
+        ValueError: the amount is negative, or the account doesn't exist
+    """
+    new_bal = account_deposit(acct, amount)
+    acct.sync_balance(new_bal)
+    logging.info(f"{cust} deposited ${round(amount, 2)} into account {acct.acct_number}; new balance ${round(acct.balance, 2)}")
+    return ledger.record(acct.acct_number, 'deposit', to_cents(amount), new_bal)
+
+@metrics.timed('banking')
+def withdraw(cust:Customer, acct:Account, amount):
+    """
+    Withdraws an amount from one of a customer's accounts.
+
+    Arguments:
+        cust(Customer): the customer making the withdrawal
+        acct(Account): the account to withdraw from
+        amount(num): the amount, in dollars
+
+    Returns:
+        the ledger Transaction for the withdrawal
+
+    Raises:
+        ValueError: the amount is negative, or more than the stored balance
+    """
+    new_bal = account_withdraw(acct, amount)
+    acct.sync_balance(new_bal)
+    logging.info(f"{cust} withdrew ${round(amount, 2)} from account {acct.acct_number}; new balance ${round(acct.balance, 2)}")
+    return ledger.record(acct.acct_number, 'withdrawal', -to_cents(amount), new_bal)
+
+@metrics.timed('banking')
+def open_credit_card(cust:Customer):
+    """
+    Opens a new CreditCard for a customer, with the bank's offered limit and rate.
+
+    Returns:
+        the new CreditCard
+    """
+    card = CreditCard(cust.cust_number, _new_acct_number(), random() * 10 + 15, randint(10, 50) * 100)
+    cust.open_creditcard(card)
+    credit_card_upsert(card)
+    logging.info(f"{cust} opened new {card}")
+    return card
+
+@metrics.timed('banking')
+def charge(cust:Customer, card:CreditCard, amount):
+    """
+    Charges an amount against one of a customer's credit cards.
+
+    Arguments:
+        cust(Customer): the customer making the charge
+        card(CreditCard): the card to charge
+        amount(num): the amount, in dollars
+
+    Returns:
+        the ledger Transaction for the charge
+
+    Raises:
+        ValueError: the amount is negative, or the charge would put the stored balance over the card's credit limit
+    """
+    new_bal = credit_card_charge(card, amount)
+    card.sync_balance(new_bal)
+    logging.info(f"{cust} charged ${round(amount, 2)} against card {card.acct_number}; new balance ${round(card.balance, 2)}")
+    return ledger.record(card.acct_number, 'charge', to_cents(amount), new_bal)
+
+@metrics.timed('banking')
+def open_loan(cust:Customer, amount, term):
+    """
+    Opens a new Loan for a customer, at the bank's offered rate.
+
+    Arguments:
+        cust(Customer): the customer taking out the loan
+        amount(num): the amount borrowed, in dollars
+        term(int): the loan term, in years
+
+    Returns:
+        the new Loan
+
+    Raises:
+        ValueError: amount or term are not positive
+    """
+    loan = Loan(cust.cust_number, _new_acct_number(), amount, random() * 4 + 1, term=term)
+    cust.open_loan(loan)
+    loan_upsert(loan)
+    ledger.record(loan.acct_number, 'open', loan.balance_cents, loan.balance_cents)
+    logging.info(f"{cust} opened new {loan}")
+    return loan
+
+@metrics.timed('banking')
+def make_payment(cust:Customer, svc, acct:Account, amount):
+    """
+    Pays an amount toward one of a customer's credit cards or loans, from one of their accounts.
+    A payment larger than the service balance only pays off the balance.
+
+    Arguments:
+        cust(Customer): the customer making the payment
+        svc(CreditCard or Loan): the card or loan being paid
+        acct(Account): the source account for the payment funds
+        amount(num): the payment amount, in dollars
+
+    Returns:
+        a Payment with the ledger Transactions for the account and for the service
+
+    Raises:
+        ValueError: the amount is not positive, the account has insufficient funds, or the payment is more than
+            the balance on file for the service, such as one another session has already paid.
+            If the database disagrees with the balances in memory, the customer's accounts and services
+            are reloaded from the database before this is raised
+    """
+    if not isinstance(svc, (CreditCard, Loan)):
+        raise ValueError(f"{svc} is not a credit card or loan")
+    old_bal = svc.balance_cents
+    svc.make_payment(amount, acct)
+    paid = old_bal - svc.balance_cents
+    try:
+        acct_bal, svc_bal = apply_payment(acct, svc, paid / 100)
+    except ValueError:
+        # the database disagrees with what we had in memory, so start over from what is on file
+        load_accts(cust)
+        raise
+    acct.sync_balance(acct_bal)
+    svc.sync_balance(svc_bal)
+    svc_type = "credit card" if isinstance(svc, CreditCard) else "loan"
+    logging.info(f"{cust} made a {svc_type} payment of ${round(amount, 2)}")
+    logging.info(f"  Source: {acct}")
+    logging.info(f"  Destination: {svc}")
+    return Payment(ledger.record(acct.acct_number, 'payment', -paid, acct.balance_cents),
+                   ledger.record(svc.acct_number, 'payment', -paid, svc.balance_cents))
+
+@metrics.timed('banking')
+def find_employee(first_name, last_name):
+    """
+    Looks up an employee by name.
+
+    Returns:
+        the Employee (the first one, if several share the name), or None if there is no such employee
+    """
+    emp = employee_srch(first_name=first_name, last_name=last_name)
+    if not emp:
+        return None
+    return emp[0] if isinstance(emp, list) else emp
+
+@metrics.timed('banking')
+def register_employee(first_name, last_name, address, city, state, zipcode, email):
+    """
+    Sets up and saves a new employee.
+
+    Returns:
+        the new Employee, with its employee number assigned
+    """
+    emp = Employee(first_name, last_name, None)
+    emp.add_contact(address, city, state, zipcode, email)
+    employee_upsert(emp)
+    return emp
+
+@metrics.timed('banking')
+def run_month_end(period = None):
+    """
+    Applies a month of interest to every account and credit card that hasn't had it for period yet.
+    Safe to run again: a finished period changes nothing, and an interrupted one picks up where it stopped.
+    See datalayer.month_end_interest
+
+    Arguments:
+        period (str): the month-end period, as 'YYYY-MM'. Defaults to the current month
+
+    Returns:
+        a dict with the 'period', the number of accounts and credit cards updated ('accounts', 'credit_cards'),
+        the total interest in dollars paid on accounts and charged on cards ('account_interest', 'credit_card_interest'),
+        and whether the period had already been run ('already_run')
+
+    Raises:
+        ValueError: period is not written as 'YYYY-MM'
+    """
+    results = month_end_interest(period)
+    if results['already_run']:
+        logging.info(f"Month end {results['period']} had already been run, nothing changed")
+        return results
+    logging.info(f"Month end {results['period']}: interest paid on {results['accounts']} accounts, total ${round(results['account_interest'], 2)}")
+    logging.info(f"Month end {results['period']}: interest charged on {results['credit_cards']} credit cards, total ${round(results['credit_card_interest'], 2)}")
+    return results
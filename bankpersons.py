@@ -2,6 +2,8 @@ from accounts import Account
 import services as sv
 
 class Person:
+    __slots__ = ('first_name', 'last_name', 'address', 'city', 'state', 'zipcode', 'email')
+
     def __init__(self, first_name, last_name):
         """ 
         Create a Person with first and last name
@@ -20,17 +22,31 @@ class Person:
         self.email = email
 
 class Employee(Person):
+    __slots__ = ('employee_number',)
+
     def __init__(self, first_name, last_name, employee_number):
         """
         Create an Employee with first and last name, and employee number
         """
         super().__init__(first_name, last_name)
         self.employee_number = employee_number
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Create an Employee from a row of the employees table: employee number, names, then contact information
+        """
+        emp = cls.__new__(cls)
+        (emp.employee_number, emp.first_name, emp.last_name, 
+         emp.address, emp.city, emp.state, emp.zipcode, emp.email) = row
+        return emp
     
     def __repr__(self):
         return f'Employee ID {self.employee_number}: {self.first_name} {self.last_name}'
 
 class Customer(Person):
+    __slots__ = ('cust_number', '_services', '_accounts', '_loader')
+
     def __init__(self, first_name, last_name, cust_number):
         """
         Create a Customer with first and last name, and customer number
@@ -38,9 +54,55 @@ class Customer(Person):
         """
         super().__init__(first_name, last_name)
         self.cust_number = cust_number
-        self.services = []
-        self.accounts = []
+        self._services = []
+        self._accounts = []
+        self._loader = None
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Create a Customer from a row of the customers table: customer number, names, then contact information.
+        Accounts and services start out empty
+        """
+        cust = cls.__new__(cls)
+        (cust.cust_number, cust.first_name, cust.last_name, 
+         cust.address, cust.city, cust.state, cust.zipcode, cust.email) = row
+        cust._services = []
+        cust._accounts = []
+        cust._loader = None
+        return cust
     
+    def lazy_load(self, loader):
+        """
+        Forget the Customer's accounts and services, and have each list loaded the first time it is used.
+        loader(cust_number, collection) returns the list for collection, either 'accounts' or 'services'
+        """
+        self._loader = loader
+        self._accounts = None
+        self._services = None
+
+    @property
+    def accounts(self):
+        """The Customer's Accounts, loaded on first use if they are lazily loaded"""
+        if self._accounts is None:
+            self._accounts = self._loader(self.cust_number, 'accounts')
+        return self._accounts
+
+    @accounts.setter
+    def accounts(self, accts):
+        self._accounts = accts
+
+    @property
+    def services(self):
+        """The Customer's CreditCards and Loans, loaded on first use if they are lazily loaded"""
+        if self._services is None:
+            self._services = self._loader(self.cust_number, 'services')
+        return self._services
+
+    @services.setter
+    def services(self, svcs):
+        self._services = svcs
+
     def __repr__(self):
         return f'Customer ID {self.cust_number}: {self.first_name} {self.last_name}'
 
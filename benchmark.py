@@ -0,0 +1,292 @@
+# Benchmarks for the simple banking system
+# Each benchmark builds a synthetic book of customers, accounts and services
+# in a scratch SQLite database, then times the operations it is interested in.
+#
+# Usage:
+#   python benchmark.py suite [--customers N] [--samples N] [--savings F] [--cards F] [--loans F] [--json FILE]
+#   python benchmark.py indexes [--customers N] [--samples N]
+#   python benchmark.py memory [--objects N]
+
+from datetime import datetime
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import tempfile
+import time
+import tracemalloc
+
+SCRATCH_DB = os.path.join(tempfile.gettempdir(), "bankbench.sqlite")
+# must be set before datalayer is imported, so the real database is never touched
+os.environ["BANK_DB_URL"] = f"sqlite:///{SCRATCH_DB}"
+
+import datalayer as dl
+import banking
+from bankpersons import Customer, Employee
+from accounts import Account
+from services import CreditCard, Loan
+
+def reset_db():
+    """Deletes the scratch database and points the datalayer at a fresh, empty one."""
+    dl.engine.dispose()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(SCRATCH_DB + suffix):
+            os.remove(SCRATCH_DB + suffix)
+    dl.configure_engine(f"sqlite:///{SCRATCH_DB}")
+
+def build_book(num_customers, seed = 0, savings = 0.5, cards = 0.5, loans = 0.2, staff = 100):
+    """
+    Fills a fresh scratch database with a synthetic book, and a staff of employees to run it.
+    Every customer has a checking account; by default about half also have a savings account,
+    half have a credit card, and one in five has a loan.
+
+    Arguments:
+        num_customers(int): number of customers to create
+        seed(int): random seed, so the same book is built every time
+        savings(float): fraction of customers who also have a savings account
+        cards(float): fraction of customers who have a credit card
+        loans(float): fraction of customers who have a loan
+        staff(int): number of employees to create
+    """
+    reset_db()
+    rnd = random.Random(seed)
+    def gen_employees():
+        for emp_num in range(1, staff + 1):
+            emp = Employee(f"Teller{emp_num}", f"Staff{emp_num}", emp_num)
+            emp.add_contact(f"{emp_num} Bank St", "Springfield", "IL", "62701", f"emp{emp_num}@example.com")
+            yield emp
+    def gen_customers():
+        for cust_num in range(1, num_customers + 1):
+            cust = Customer(f"First{cust_num}", f"Last{cust_num}", cust_num)
+            cust.add_contact(f"{cust_num} Main St", "Springfield", "IL", "62701", f"cust{cust_num}@example.com")
+            yield cust
+    def gen_accounts():
+        for cust_num in range(1, num_customers + 1):
+            acct = Account(cust_num, cust_num * 10, "checking")
+            acct.deposit(rnd.uniform(0, 5000))
+            yield acct
+            if rnd.random() < savings:
+                acct = Account(cust_num, cust_num * 10 + 1, "savings", rnd.uniform(0.1, 3))
+                acct.deposit(rnd.uniform(0, 20000))
+                yield acct
+    def gen_cards():
+        for cust_num in range(1, num_customers + 1):
+            if rnd.random() < cards:
+                yield CreditCard(cust_num, cust_num * 10 + 2, rnd.uniform(15, 25), rnd.randint(10, 50) * 100,
+                                 balance = rnd.uniform(0, 1000))
+    def gen_loans():
+        for cust_num in range(1, num_customers + 1):
+            if rnd.random() < loans:
+                yield Loan(cust_num, cust_num * 10 + 3, rnd.uniform(1000, 300000), rnd.uniform(1, 5),
+                           term = rnd.choice([5, 15, 30]))
+    dl.employees_bulk_upsert(gen_employees())
+    dl.customers_bulk_upsert(gen_customers())
+    dl.accounts_bulk_upsert(gen_accounts())
+    dl.credit_cards_bulk_upsert(gen_cards())
+    dl.loans_bulk_upsert(gen_loans())
+
+def time_calls(func, args_list):
+    """
+    Calls func once for each set of arguments.
+
+    Returns:
+        a sorted list of the latency of each call, in seconds
+    """
+    latencies = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        latencies.append(time.perf_counter() - start)
+    return sorted(latencies)
+
+def percentile(sorted_values, pct):
+    """The pct-th percentile of an already sorted list"""
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))]
+
+def summarize(name, latencies):
+    print(f"  {name:<12} p50 {percentile(latencies, 50) * 1000:10.3f} ms   p99 {percentile(latencies, 99) * 1000:10.3f} ms")
+
+def bench_indexes(args):
+    """Login lookup and account load latency without, then with, the owner and name indexes."""
+    print(f"Building a book of {args.customers} customers...")
+    build_book(args.customers)
+    rnd = random.Random(1)
+    sample = [rnd.randint(1, args.customers) for _ in range(args.samples)]
+    logins = [(f"First{cust_num}", f"Last{cust_num}") for cust_num in sample]
+    custs = [(dl.customer_srch(cust_id = cust_num),) for cust_num in sample]
+    with dl.engine.connect() as conn:
+        for table in dl.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(conn)
+    print("Before (no secondary indexes):")
+    summarize("login", time_calls(lambda first, last: dl.customer_srch(first_name = first, last_name = last), logins))
+    summarize("load_accts", time_calls(lambda cust: dl.load_accts(cust, prefetch = True), custs))
+    with dl.engine.connect() as conn:
+        dl._add_indexes(conn)
+    print("After (indexes added by the migration step):")
+    summarize("login", time_calls(lambda first, last: dl.customer_srch(first_name = first, last_name = last), logins))
+    summarize("load_accts", time_calls(lambda cust: dl.load_accts(cust, prefetch = True), custs))
+
+def bytes_per_object(build, count):
+    """
+    Builds count objects and measures the memory they take with tracemalloc.
+    Includes the 8-byte pointer to each object in the list holding them.
+
+    Returns:
+        average bytes per object
+    """
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objs = [build(i) for i in range(count)]
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objs
+    return used / count
+
+def new_customer(cust_num):
+    cust = Customer(f"First{cust_num}", f"Last{cust_num}", cust_num)
+    cust.add_contact("1 Main St", "Springfield", "IL", "62701", "cust@example.com")
+    return cust
+
+def new_account(acct_num):
+    acct = Account(acct_num, acct_num, "savings", 1.5)
+    acct.deposit(acct_num * 0.5)
+    return acct
+
+_unslotted = {}
+
+def with_dict(obj):
+    """
+    A copy of a slotted object that keeps the same attributes in a per-instance __dict__ instead,
+    as the domain classes did before they had __slots__. Attributes are set in slot order, like __init__ does,
+    so the copies of one class share their dict keys the way instances of an unslotted class do.
+    """
+    cls = type(obj)
+    if cls not in _unslotted:
+        _unslotted[cls] = type(cls.__name__ + "WithDict", (), {})
+    copy = _unslotted[cls]()
+    for klass in reversed(cls.__mro__):
+        for attr in getattr(klass, "__slots__", ()):
+            if hasattr(obj, attr):
+                setattr(copy, attr, getattr(obj, attr))
+    return copy
+
+def bench_memory(args):
+    """
+    Bytes per in-memory domain object, as built when hydrating the book: as the classes are now, with __slots__,
+    and the same objects with their attributes in a __dict__, as before __slots__.
+    """
+    print(f"Bytes per object, hydrating {args.objects} of each:")
+    print(f"  {'':<12} {'__dict__':>8} {'slots':>8} {'saved':>8}")
+    for name, build in (("Customer", new_customer), ("Account", new_account),
+                        ("CreditCard", lambda acct_num: CreditCard(acct_num, acct_num, 19.9, 5000, balance = acct_num * 0.5)),
+                        ("Loan", lambda acct_num: Loan(acct_num, acct_num, 1000 + acct_num, 3.5))):
+        before = bytes_per_object(lambda i: with_dict(build(i)), args.objects)
+        after = bytes_per_object(build, args.objects)
+        print(f"  {name:<12} {before:8.1f} {after:8.1f} {(before - after) / before:8.1%}")
+
+def measure(func, args_list, mem_args = None):
+    """
+    Times func once for each set of arguments, then traces one more call with tracemalloc to find its peak memory.
+    Tracing is slow, so it is kept out of the timed calls.
+
+    Arguments:
+        func: the operation to measure
+        args_list(list): a tuple of arguments for each timed call
+        mem_args(tuple): arguments for the traced call. Defaults to the first of args_list
+
+    Returns:
+        a dict of the number of calls, throughput (calls per second), mean, p50 and p99 latency (ms),
+        and the peak memory allocated during the traced call (bytes). None if args_list is empty, as when
+        the book has no cards or loans to sample
+    """
+    if not args_list:
+        return None
+    latencies = time_calls(func, args_list)
+    tracemalloc.start()
+    func(*(mem_args if mem_args is not None else args_list[0]))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    total = sum(latencies)
+    return {"calls": len(latencies), "throughput": len(latencies) / total if total else None,
+            "mean_ms": total / len(latencies) * 1000, "p50_ms": percentile(latencies, 50) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000, "peak_bytes": peak}
+
+def book_counts():
+    """Number of rows in each table of the book"""
+    with dl.engine.connect() as conn:
+        return {table.name: conn.execute(dl.select([dl.func.count()]).select_from(table)).scalar()
+                for table in (dl.employees, dl.customers, dl.accounts, dl.credit_cards, dl.loans)}
+
+def bench_suite(args):
+    """
+    Times the operations the system depends on, against a synthetic book: login, load_accts (prefetched, and lazily
+    reading the accounts only), each *_upsert, make_payment, full-book hydration and month-end.
+    Prints a table, and with --json writes the results as JSON so runs of different versions can be compared.
+    """
+    print(f"Building a book of {args.customers} customers...")
+    build_book(args.customers, savings = args.savings, cards = args.cards, loans = args.loans)
+    rnd = random.Random(1)
+    # a pool of loaded customers to draw samples from, big enough to find enough with cards and loans
+    pool = [dl.customer_srch(cust_id = cust_num) for cust_num in rnd.sample(range(1, args.customers + 1),
+                                                                           min(args.customers, args.samples * 5))]
+    for cust in pool:
+        dl.load_accts(cust, prefetch = True)
+    custs = pool[:args.samples]
+    staff = dl.employee_srch()
+    emps = [staff[i % len(staff)] for i in range(args.samples)]
+    accts = [acct for cust in pool for acct in cust.accounts][:args.samples]
+    cards = [svc for cust in pool for svc in cust.services if isinstance(svc, CreditCard)][:args.samples]
+    loans = [svc for cust in pool for svc in cust.services if isinstance(svc, Loan)][:args.samples]
+    payments = [(cust, svc, cust.accounts[0], 0.01) for cust in pool for svc in cust.services
+                if isinstance(svc, CreditCard) and svc.balance_cents > 0 and cust.accounts[0].balance_cents > 0][:args.samples]
+    runs = min(args.samples, 3)
+    results = {}
+    results["login"] = measure(lambda first, last: dl.customer_srch(first_name = first, last_name = last),
+                               [(cust.first_name, cust.last_name) for cust in custs])
+    results["load_accts"] = measure(lambda cust: dl.load_accts(cust, prefetch = True), [(cust,) for cust in custs])
+    # what a single-action session reads: the accounts only, lazily
+    results["load_accounts_only"] = measure(lambda cust: (dl.load_accts(cust), cust.accounts), [(cust,) for cust in custs])
+    results["employee_upsert"] = measure(dl.employee_upsert, [(emp,) for emp in emps])
+    results["customer_upsert"] = measure(dl.customer_upsert, [(cust,) for cust in custs])
+    results["account_upsert"] = measure(dl.account_upsert, [(acct,) for acct in accts])
+    results["credit_card_upsert"] = measure(dl.credit_card_upsert, [(card,) for card in cards])
+    results["loan_upsert"] = measure(dl.loan_upsert, [(loan,) for loan in loans])
+    results["make_payment"] = measure(banking.make_payment, payments[1:], payments[0] if payments else None)
+    results["hydrate_all"] = measure(dl.load_all_customers, [()] * runs)
+    results["hydrate_stream"] = measure(lambda: sum(1 for cust in dl.iter_customers()), [()] * runs)
+    # the traced run needs a period after the timed ones, or it would find nothing left to do
+    results["month_end"] = measure(banking.run_month_end, [(f"{2000 + year}-01",) for year in range(runs)],
+                                   (f"{2000 + runs}-01",))
+    skipped = [name for name, result in results.items() if result is None]
+    results = {name: result for name, result in results.items() if result is not None}
+    print(f"  {'operation':<20} {'calls':>6} {'ops/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'peak KiB':>10}")
+    for name, result in results.items():
+        print(f"  {name:<20} {result['calls']:>6} {result['throughput']:>10.1f} {result['p50_ms']:>10.3f} "
+              f"{result['p99_ms']:>10.3f} {result['peak_bytes'] / 1024:>10.1f}")
+    for name in skipped:
+        print(f"  {name:<20} skipped, the book has nothing to sample")
+    if args.json:
+        report = {"benchmark": "suite", "timestamp": datetime.now().isoformat(timespec = "seconds"),
+                  "python": platform.python_version(), "sqlite": sqlite3.sqlite_version, "platform": platform.platform(),
+                  "customers": args.customers, "samples": args.samples, "book": book_counts(), "results": results, "skipped": skipped}
+        with open(args.json, "w") as json_file:
+            json.dump(report, json_file, indent = 2)
+        print(f"Results written to {args.json}")
+
+benchmarks = {"suite": bench_suite, "indexes": bench_indexes, "memory": bench_memory}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the simple banking system")
+    parser.add_argument("benchmark", choices=sorted(benchmarks))
+    parser.add_argument("--customers", type=int, default=100000, help="number of customers in the synthetic book")
+    parser.add_argument("--samples", type=int, default=200, help="number of timed calls per operation")
+    parser.add_argument("--objects", type=int, default=1000000, help="number of each domain object to build")
+    parser.add_argument("--savings", type=float, default=0.5, help="fraction of customers with a savings account")
+    parser.add_argument("--cards", type=float, default=0.5, help="fraction of customers with a credit card")
+    parser.add_argument("--loans", type=float, default=0.2, help="fraction of customers with a loan")
+    parser.add_argument("--json", help="also write the suite's results to this JSON file")
+    args = parser.parse_args()
+    benchmarks[args.benchmark](args)
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+import threading
+import time
+
+class LRUCache:
+    """
+    A least-recently-used cache, with an optional time-to-live on each entry. Safe to share between threads.
+
+    Attributes:
+        max_size (int): The most entries the cache will hold; the least recently used entry is evicted to make room
+        ttl (num): Seconds an entry stays valid after it is stored, or None for no expiry
+        hits (int): Number of lookups that found a valid entry
+        misses (int): Number of lookups that found nothing, or an expired entry
+        evictions (int): Number of entries removed to make room for new ones
+
+    Methods:
+        get: Look up an entry
+        put: Store an entry
+        invalidate: Remove an entry
+        clear: Remove all entries
+        stats: Current size and counters
+    """
+    def __init__(self, max_size = 10000, ttl = None):
+        """
+        Creates an empty cache.
+
+        Args:
+            max_size (int): The most entries the cache will hold
+            ttl (num): Seconds an entry stays valid after it is stored. Defaults to no expiry
+
+        Raises:
+            ValueError: max_size is not positive
+        """
+        if max_size <= 0:
+            raise ValueError("Cache size must be positive")
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default = None):
+        """
+        Looks up an entry, marking it as most recently used.
+
+        Args:
+            key: the entry's key
+            default: returned if there is no valid entry for key
+
+        Returns:
+            the cached value, or default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and (entry[1] is None or entry[1] > time.monotonic()):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        """Stores an entry, evicting the least recently used ones if the cache is full"""
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last = False)
+                self.evictions += 1
+
+    def invalidate(self, *keys):
+        """Removes the entries for any of the specified keys"""
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes all entries. The counters are kept"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """
+        Returns:
+            a dict of the cache's size, max_size, hits, misses and evictions
+        """
+        return {'size': len(self._entries), 'max_size': self.max_size,
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
@@ -1,20 +1,46 @@
-from sqlalchemy import Table, Column, Integer, String, MetaData, DATE
-from sqlalchemy import create_engine, Sequence, ForeignKey, Float
-from sqlalchemy.sql import select, and_
+from sqlalchemy import Table, Column, Integer, String, MetaData, DATE, DateTime
+from sqlalchemy import create_engine, Sequence, ForeignKey, Float, Index, event, inspect
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool, StaticPool
+from sqlalchemy.util import LRUCache as CompiledCache
+from sqlalchemy.sql import select, and_, or_, exists, func, text, bindparam, cast, literal
+from itertools import islice
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+import os
+import threading
+import time
 from bankpersons import Employee, Customer
 from accounts import Account
 from services import CreditCard, Loan
+from cache import LRUCache
+from money import to_cents
+import metrics
 
-engine = create_engine("sqlite:///bankdata.sqlite")
+DEFAULT_URL = "sqlite:///bankdata.sqlite"
+
+# applied to every new SQLite connection, unless create_bank_engine is given other pragmas
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'cache_size': -64000,       # negative means KiB, so 64MB
+    'mmap_size': 268435456,     # 256MB
+    'busy_timeout': 30000       # milliseconds
+}
+
+engine = None
 metadata = MetaData()
 
-# define tables
+# define tables. Amounts of money (balance, limit, cashlimit, minpayment, monthlypmt) are whole cents.
+# lastaccrual is the last month-end period ('YYYY-MM') an account or card was paid/charged interest for
 employees = Table('employees', metadata,
     Column('empid', Integer, Sequence('empid_seq'), primary_key = True),
     Column('firstname', String), Column('lastname', String),
     Column('address', String), Column('city', String),
     Column('state', String(2)), Column('zipcode', String(5)),
-    Column('email', String)
+    Column('email', String),
+    Index('ix_employees_name', 'firstname', 'lastname')
 )
 
 customers = Table('customers', metadata,
@@ -22,55 +48,536 @@ customers = Table('customers', metadata,
     Column('firstname', String), Column('lastname', String),
     Column('address', String), Column('city', String),
     Column('state', String(2)), Column('zipcode', String(5)),
-    Column('email', String)
+    Column('email', String),
+    Index('ix_customers_name', 'firstname', 'lastname')
 )
 
 accounts = Table('accounts', metadata,
     Column('acctnum', Integer, primary_key = True),
     Column('owner', None, ForeignKey('customers.custid')),
-    Column('accttype', String), Column('balance', Float),
-    Column('intrate', Float)
+    Column('accttype', String), Column('balance', Integer),
+    Column('intrate', Float), Column('lastaccrual', String(7)),
+    Index('ix_accounts_owner', 'owner')
 )
 
 credit_cards = Table('creditcards', metadata,
     Column('acctnum', Integer, primary_key = True),
     Column('owner', None, ForeignKey('customers.custid')),
-    Column('balance', Float), Column('intrate', Float),
-    Column('opendate', DATE), Column('limit', Float),
-    Column('cashlimit', Float), Column('minpayment', Float)
+    Column('balance', Integer), Column('intrate', Float),
+    Column('opendate', DATE), Column('limit', Integer),
+    Column('cashlimit', Integer), Column('minpayment', Integer),
+    Column('lastaccrual', String(7)),
+    Index('ix_creditcards_owner', 'owner')
 )
 
 loans = Table('loans', metadata,
     Column('acctnum', Integer, primary_key = True),
     Column('owner', None, ForeignKey('customers.custid')),
-    Column('balance', Float), Column('intrate', Float),
+    Column('balance', Integer), Column('intrate', Float),
     Column('opendate', DATE), Column('maturitydate', DATE),
-    Column('monthlypmt', Float)
+    Column('monthlypmt', Integer),
+    Index('ix_loans_owner', 'owner')
+)
+
+# append-only ledger of every change to an account, card or loan balance. 
+# kind is one of deposit, withdrawal, charge, payment, interest, open (a loan's opening balance),
+# or adjustment (a balance overwritten by an upsert);
+# amount is the signed change to the balance and balance is the resulting balance, both in cents
+transactions = Table('transactions', metadata,
+    Column('txnid', Integer, Sequence('txnid_seq'), primary_key = True),
+    Column('acctnum', Integer), Column('kind', String),
+    Column('amount', Integer), Column('ts', DateTime),
+    Column('balance', Integer),
+    Index('ix_transactions_acctnum_ts', 'acctnum', 'ts')
+)
+
+# balance of an account, card or loan at a point in time, so an as-of balance only replays the ledger after it
+balance_checkpoints = Table('balancecheckpoints', metadata,
+    Column('acctnum', Integer, primary_key = True),
+    Column('ts', DateTime, primary_key = True),
+    Column('balance', Integer)
+)
+
+# month-end progress, one row per shard of the customer number keyspace. A shard covers the accounts and cards
+# of owners from lo (inclusive) to hi (exclusive), where NULL means unbounded. completed is set in the same
+# transaction that applies the shard's interest, so a completed shard is never applied twice in a period
+month_end_shards = Table('monthendshards', metadata,
+    Column('period', String(7), primary_key = True),
+    Column('shard', Integer, primary_key = True),
+    Column('lo', Integer), Column('hi', Integer),
+    Column('accounts', Integer), Column('creditcards', Integer),
+    Column('acctinterest', Integer), Column('cardinterest', Integer),
+    Column('seconds', Float), Column('completed', DateTime)
+)
+
+# one row per month-end period: when it started and finished, and its running totals, in cents,
+# which are updated in the same transaction as each batch. finished is NULL until every batch is done
+month_end_runs = Table('monthendruns', metadata,
+    Column('period', String(7), primary_key = True),
+    Column('started', DateTime), Column('finished', DateTime),
+    Column('batches', Integer),
+    Column('accounts', Integer), Column('creditcards', Integer),
+    Column('acctinterest', Integer), Column('cardinterest', Integer)
 )
 
-metadata.create_all(engine)
+# the columns each domain class's from_row takes, in order
+_row_cols = {table: [table.c[name] for name in names] for table, names in (
+    (employees, ['empid', 'firstname', 'lastname', 'address', 'city', 'state', 'zipcode', 'email']),
+    (customers, ['custid', 'firstname', 'lastname', 'address', 'city', 'state', 'zipcode', 'email']),
+    (accounts, ['acctnum', 'owner', 'accttype', 'balance', 'intrate']),
+    (credit_cards, ['acctnum', 'owner', 'balance', 'intrate', 'opendate', 'limit', 'cashlimit', 'minpayment']),
+    (loans, ['acctnum', 'owner', 'balance', 'intrate', 'opendate', 'maturitydate', 'monthlypmt']))}
+
+# statements for the hot paths, built once with bound parameters. Executing the same statement object lets
+# the engine's compiled_cache compile it just once, so each call only binds parameters and executes
+_by_id = {employees: select(_row_cols[employees]).where(employees.c.empid == bindparam('id')),
+          customers: select(_row_cols[customers]).where(customers.c.custid == bindparam('id'))}
+_by_name = {table: select(_row_cols[table]).where(and_(table.c.firstname == bindparam('first_name'), 
+                                                       table.c.lastname == bindparam('last_name')))
+            for table in (employees, customers)}
+_select_all = {table: select(_row_cols[table]) for table in (employees, customers)}
+_inserts = {table: table.insert() for table in (employees, customers)}
+_by_acctnum = {table: select(_row_cols[table]).where(table.c.acctnum == bindparam('acct_num')) for table in (accounts, credit_cards, loans)}
+_by_owner = {table: select(_row_cols[table]).where(table.c.owner == bindparam('cust_num')) for table in (accounts, credit_cards, loans)}
+# adds delta cents to the balance of an account, card or loan
+_add_to_balance = {table: table.update().where(table.c.acctnum == bindparam('acct_num'))
+                                        .values(balance = table.c.balance + bindparam('delta'))
+                   for table in (accounts, credit_cards, loans)}
+# takes cents from an account's balance, only if the balance covers it
+_debit = accounts.update().where(and_(accounts.c.acctnum == bindparam('acct_num'), accounts.c.balance >= bindparam('cents'))) \
+                          .values(balance = accounts.c.balance - bindparam('cents'))
+# adds cents to a card's balance, only if it stays within the card's limit
+_charge = credit_cards.update().where(and_(credit_cards.c.acctnum == bindparam('acct_num'), 
+                                           credit_cards.c.balance + bindparam('cents') <= credit_cards.c.limit)) \
+                               .values(balance = credit_cards.c.balance + bindparam('cents'))
+# takes cents off the balance of a card or loan, only if the balance is at least that much
+_pay_down = {table: table.update().where(and_(table.c.acctnum == bindparam('acct_num'), table.c.balance >= bindparam('cents')))
+                                  .values(balance = table.c.balance - bindparam('cents'))
+             for table in (credit_cards, loans)}
+_balance_of = {table: select([table.c.balance]).where(table.c.acctnum == bindparam('acct_num')) 
+               for table in (accounts, credit_cards, loans)}
+# appends an 'adjustment' ledger entry for a row whose stored balance differs from new_balance, before it is overwritten
+_record_overwrite = {table: transactions.insert().from_select(['acctnum', 'kind', 'amount', 'ts', 'balance'],
+                         select([table.c.acctnum, literal('adjustment'), bindparam('new_balance', type_=Integer) - table.c.balance,
+                                 bindparam('when', type_=DateTime), bindparam('new_balance', type_=Integer)])
+                         .where(and_(table.c.acctnum == bindparam('acct_num'), table.c.balance != bindparam('new_balance'))))
+                     for table in (accounts, credit_cards, loans)}
+
+def create_bank_engine(url = DEFAULT_URL, pool_size = 5, max_overflow = 10, pool_pre_ping = True, pragmas = None,
+                       compiled_cache_size = 500):
+    """
+    Creates a pooled engine for the banking database.
+
+    Arguments:
+        url(str): SQLAlchemy database URL
+        pool_size(int): Number of connections kept open in the pool
+        max_overflow(int): Number of connections allowed beyond pool_size when the pool is exhausted
+        pool_pre_ping(bool): Whether to test each connection as it is checked out of the pool
+        pragmas(dict): SQLite only -- PRAGMA name -> value, run on every new connection. Defaults to SQLITE_PRAGMAS
+        compiled_cache_size(int): Number of compiled statements the engine keeps, so executing the same statement 
+            object again skips compiling it. 0 turns the cache off
+
+    Returns:
+        the new Engine
+    """
+    db_url = make_url(url)
+    kwargs = {'pool_pre_ping': pool_pre_ping}
+    if compiled_cache_size:
+        kwargs['execution_options'] = {'compiled_cache': CompiledCache(compiled_cache_size)}
+    if db_url.get_backend_name() == 'sqlite':
+        # pooled connections get handed between threads, which pysqlite refuses by default
+        kwargs['connect_args'] = {'check_same_thread': False}
+        if db_url.database in (None, '', ':memory:'):
+            # every connection to an in-memory database is a different database, so share just one
+            kwargs['poolclass'] = StaticPool
+        else:
+            kwargs.update(poolclass = QueuePool, pool_size = pool_size, max_overflow = max_overflow)
+    else:
+        kwargs.update(pool_size = pool_size, max_overflow = max_overflow)
+    new_engine = create_engine(db_url, **kwargs)
+    if new_engine.dialect.name == 'sqlite':
+        pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+        @event.listens_for(new_engine, "connect")
+        def set_pragmas(dbapi_conn, conn_record):
+            cursor = dbapi_conn.cursor()
+            for name, value in pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            cursor.close()
+    metrics.instrument_engine(new_engine)
+    return new_engine
+
+def configure_engine(url = DEFAULT_URL, **kwargs):
+    """
+    Points every datalayer function at a new engine, creating any missing tables.
+    Takes the same arguments as create_bank_engine.
+
+    Returns:
+        the new Engine
+    """
+    global engine
+    if engine is not None:
+        engine.dispose()
+    engine = create_bank_engine(url, **kwargs)
+    with engine.connect() as conn:
+        is_new_db = not engine.dialect.has_table(conn, 'customers')
+        metadata.create_all(conn)
+        if is_new_db:
+            _set_schema_version(conn, len(MIGRATIONS))
+        else:
+            _migrate(conn)
+    return engine
+
+def _add_indexes(conn):
+    """Migration: creates the secondary indexes declared on the tables, where they don't already exist"""
+    for table in metadata.sorted_tables:
+        existing = {idx['name'] for idx in inspect(conn).get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(conn)
+
+# columns of each money table before _money_to_cents, and which of them held dollars
+_DOLLAR_TABLES = {
+    'accounts': (['acctnum', 'owner', 'accttype', 'balance', 'intrate'], ['balance']),
+    'creditcards': (['acctnum', 'owner', 'balance', 'intrate', 'opendate', 'limit', 'cashlimit', 'minpayment'], 
+                    ['balance', 'limit', 'cashlimit', 'minpayment']),
+    'loans': (['acctnum', 'owner', 'balance', 'intrate', 'opendate', 'maturitydate', 'monthlypmt'], ['balance', 'monthlypmt'])
+}
+
+def _money_to_cents(conn):
+    """
+    Migration: converts the money columns from dollars in REAL columns to whole cents in INTEGER columns.
+    SQLite can't change a column's type, so each table is renamed, recreated, copied across and dropped.
+    A table left renamed by an earlier attempt that stopped part way is copied across again from the start.
+    """
+    quote = conn.dialect.identifier_preparer.quote
+    existing = set(inspect(conn).get_table_names())
+    for table in (accounts, credit_cards, loans):
+        cols, dollar_cols = _DOLLAR_TABLES[table.name]
+        old_name = table.name + '_dollars'
+        if old_name not in existing:
+            for index in table.indexes:
+                conn.execute(text(f"DROP INDEX IF EXISTS {quote(index.name)}"))
+            conn.execute(text(f"ALTER TABLE {quote(table.name)} RENAME TO {quote(old_name)}"))
+        table.create(conn, checkfirst = True)
+        conn.execute(table.delete())
+        # rounding to 2 places first reads a float as the decimal it displays as, like money.to_cents: 0.285 * 100
+        # is 28.4999..., which would round down
+        exprs = [f"CAST(ROUND(ROUND({quote(col)}, 2) * 100) AS INTEGER)" if col in dollar_cols else quote(col) for col in cols]
+        conn.execute(text(f"INSERT INTO {quote(table.name)} ({', '.join(quote(col) for col in cols)}) "
+                          f"SELECT {', '.join(exprs)} FROM {quote(old_name)}"))
+        conn.execute(text(f"DROP TABLE {quote(old_name)}"))
+
+def _seed_checkpoints(conn):
+    """
+    Migration: checkpoints every current balance, since balances from before the ledger existed
+    have no history to replay
+    """
+    now = datetime.now()
+    for table in (accounts, credit_cards, loans):
+        conn.execute(balance_checkpoints.insert().from_select(['acctnum', 'ts', 'balance'],
+            select([table.c.acctnum, literal(now, DateTime), table.c.balance])))
+
+def _add_accrual_markers(conn):
+    """Migration: adds the lastaccrual column to accounts and creditcards, where it isn't already there"""
+    for table in (accounts, credit_cards):
+        if 'lastaccrual' not in {col['name'] for col in inspect(conn).get_columns(table.name)}:
+            conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN lastaccrual VARCHAR(7)"))
+
+# schema changes for databases created by earlier versions, in the order they were made.
+# A database's schema version is the number of these already applied to it.
+MIGRATIONS = [_add_indexes, _money_to_cents, _seed_checkpoints, _add_accrual_markers]
+
+def _schema_version(conn):
+    """The schema version of the database; only SQLite databases are versioned, others always count as current"""
+    if conn.dialect.name != 'sqlite':
+        return len(MIGRATIONS)
+    return conn.execute(text("PRAGMA user_version")).scalar()
+
+def _set_schema_version(conn, version):
+    if conn.dialect.name == 'sqlite':
+        conn.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+@contextmanager
+def _ddl_transaction(conn):
+    """
+    A transaction that schema changes are part of too. pysqlite only opens a transaction at the first 
+    INSERT/UPDATE/DELETE, so DDL before that would be committed as it runs; on SQLite the driver's own 
+    transaction handling is turned off for the block and the transaction begun explicitly.
+    """
+    if conn.dialect.name != 'sqlite':
+        with conn.begin():
+            yield
+        return
+    dbapi_conn = conn.connection.connection
+    isolation_level = dbapi_conn.isolation_level
+    dbapi_conn.isolation_level = None
+    try:
+        with conn.begin():
+            conn.execute(text("BEGIN"))
+            yield
+    finally:
+        dbapi_conn.isolation_level = isolation_level
 
+def _migrate(conn):
+    """Applies, in order, each migration the database hasn't had yet, each one in its own transaction"""
+    for version in range(_schema_version(conn), len(MIGRATIONS)):
+        with _ddl_transaction(conn):
+            MIGRATIONS[version](conn)
+            _set_schema_version(conn, version + 1)
+
+_shared = threading.local()
+
+@contextmanager
+def session():
+    """
+    Shares one pooled connection across every datalayer call made inside this block, on this thread.
+    Nested sessions reuse the outer session's connection.
+
+    Yields:
+        the shared Connection
+    """
+    if getattr(_shared, 'conn', None) is not None:
+        yield _shared.conn
+        return
+    with engine.connect() as conn:
+        _shared.conn = conn
+        try:
+            yield conn
+        finally:
+            _shared.conn = None
+
+@contextmanager
+def _connect():
+    """Connection for one datalayer call: the current session's connection if there is one, otherwise one from the pool"""
+    conn = getattr(_shared, 'conn', None)
+    if conn is not None:
+        yield conn
+    else:
+        with engine.connect() as conn:
+            yield conn
+
+configure_engine(os.environ.get('BANK_DB_URL', DEFAULT_URL))
+
+_cache = None
+_MISSING = object()
+
+def enable_cache(max_size = 10000, ttl = None):
+    """
+    Turns on the in-process cache of customer, account, credit card and loan lookups.
+    Cached searches by customer number, account number and customer name skip the database;
+    the *_upsert functions write through to the cache, and invalidate the searches by the old and new name or owner
+    of what they write; other writes invalidate what they touch.
+    The cache holds rows, not objects: every search builds its own objects, so changing one never
+    changes what a later search returns.
+
+    Arguments:
+        max_size(int): The most lookups to keep; the least recently used are evicted past this
+        ttl(num): Seconds a cached lookup stays valid. Defaults to no expiry
+    """
+    global _cache
+    _cache = LRUCache(max_size, ttl)
+
+def disable_cache():
+    """Turns off and empties the lookup cache"""
+    global _cache
+    _cache = None
+
+def cache_stats():
+    """
+    Returns:
+        a dict of the lookup cache's size, max_size, hits, misses and evictions, or None if caching is off
+    """
+    return _cache.stats() if _cache is not None else None
+
+def _cache_get(key):
+    """The cached value for key, or _MISSING if there is none (or caching is off)"""
+    if _cache is None or key is None:
+        return _MISSING
+    return _cache.get(key, _MISSING)
+
+def _cache_put(key, value):
+    if _cache is not None and key is not None:
+        _cache.put(key, value)
+
+def _cache_invalidate(*keys):
+    if _cache is not None:
+        _cache.invalidate(*keys)
+
+def _cache_clear():
+    if _cache is not None:
+        _cache.clear()
+
+def _cached_rows(key, stmt, params = None):
+    """
+    The rows a search statement returns, as tuples, from the lookup cache if they are there.
+
+    Arguments:
+        key: the cache key for the search, or None for a search that isn't cached
+        stmt: the statement to run on a cache miss
+        params(dict): the statement's parameters
+    """
+    rows = _cache_get(key)
+    if rows is _MISSING:
+        with _connect() as conn:
+            rows = [tuple(row) for row in conn.execute(stmt, params or {})]
+        _cache_put(key, rows)
+    return rows
+
+def _cache_row(key, table, values:dict):
+    """Writes one row through to the lookup cache under key, in the column order its from_row takes"""
+    if _cache is not None:
+        _cache.put(key, [tuple(values[col.name] for col in _row_cols[table])])
+
+def _row_before_write(key, stmt, params):
+    """
+    The row an upsert is about to overwrite, from the lookup cache or else the database, so the search keys
+    of its old values (a customer's old name, an account's old owner) can be invalidated after the write.
+    Returns None if the cache is off, or there is no such row
+    """
+    if _cache is None:
+        return None
+    rows = _cached_rows(key, stmt, params)
+    return rows[0] if rows else None
+
+def _srch_key(kind, acct_num, cust_num):
+    """Cache key for an account/credit card/loan search, by account number or else by owner"""
+    if acct_num != None:
+        return (kind, acct_num)
+    if cust_num != None:
+        return (kind + 's', cust_num)
+    return None
+
+_upsert_stmts = {}
+
+def _upsert_stmt(dialect, table, cols):
+    """
+    Builds (once) the native upsert statement for the specified table and columns.
+
+    Arguments:
+        dialect: the SQLAlchemy dialect the statement will run on
+        table(Table): the table to upsert into
+        cols(tuple): names of the columns being written; must include the primary key
+
+    Returns:
+        a text() statement using INSERT ... ON CONFLICT DO UPDATE, or None if the database doesn't support it
+    """
+    key = (dialect.name, table.name, cols)
+    if key not in _upsert_stmts:
+        stmt = None
+        native = dialect.name == 'postgresql' or \
+            (dialect.name == 'sqlite' and dialect.dbapi.sqlite_version_info >= (3, 24, 0))
+        if native:
+            quote = dialect.identifier_preparer.quote
+            pk_cols = [col.name for col in table.primary_key]
+            sql = f"INSERT INTO {quote(table.name)} ({', '.join(quote(col) for col in cols)}) "
+            sql += f"VALUES ({', '.join(':' + col for col in cols)}) "
+            sql += f"ON CONFLICT ({', '.join(quote(col) for col in pk_cols)}) DO UPDATE SET "
+            sql += ', '.join(f"{quote(col)} = excluded.{quote(col)}" for col in cols if col not in pk_cols)
+            stmt = text(sql).bindparams(*[bindparam(col, type_=table.c[col].type) for col in cols])
+        _upsert_stmts[key] = stmt
+    return _upsert_stmts[key]
+
+def _upsert(conn, table, values:dict):
+    """
+    Adds a new or updates an existing row in a single statement, keyed on the table's primary key.
+    Databases without a native upsert fall back to an UPDATE, followed by an INSERT only if no row was updated.
+
+    Arguments:
+        conn: the connection to execute on
+        table(Table): the table to upsert into
+        values(dict): column name -> value for the row, including the primary key
+    """
+    stmt = _upsert_stmt(conn.dialect, table, tuple(values))
+    if stmt is not None:
+        conn.execute(stmt, values)
+    else:
+        pk_clause = and_(*[col == values[col.name] for col in table.primary_key])
+        if conn.execute(table.update().where(pk_clause).values(**values)).rowcount == 0:
+            conn.execute(table.insert().values(**values))
+
+def _write_checkpoints(conn, balances, ts):
+    """
+    Checkpoints balances written outside the ledger, so as_of_balance starts from them
+    instead of replaying ledger entries that never saw the change.
+
+    Arguments:
+        conn: the connection to write on, in the caller's transaction
+        balances(list): (account number, balance in cents) pairs
+        ts(datetime): the time of the checkpoints
+    """
+    if not balances:
+        return
+    rows = [{'acctnum': acct_num, 'ts': ts, 'balance': balance} for acct_num, balance in balances]
+    stmt = _upsert_stmt(conn.dialect, balance_checkpoints, ('acctnum', 'ts', 'balance'))
+    if stmt is not None:
+        conn.execute(stmt, rows)
+    else:
+        for values in rows:
+            _upsert(conn, balance_checkpoints, values)
+
+def _upsert_balance(conn, table, rows, ts = None):
+    """
+    Upserts rows of accounts, creditcards or loans. Where that overwrites an existing row's balance, the change
+    is first written to the ledger as an 'adjustment', so as_of_balance can replay it. That is a single
+    INSERT ... SELECT reading the old balance, and being a write, it takes the write lock before the upsert runs.
+    A new row gets no entry; its history starts with its own ledger entries, such as an opening deposit
+
+    Arguments:
+        conn: the connection to write on, in the caller's transaction
+        table(Table): accounts, credit_cards or loans
+        rows(list): column name -> value dicts, one per row, including acctnum and balance
+        ts(datetime): the time of the ledger entries. Defaults to now
+    """
+    ts = ts or datetime.now()
+    conn.execute(_record_overwrite[table], [{'acct_num': values['acctnum'], 'new_balance': values['balance'], 'when': ts}
+                                            for values in rows])
+    stmt = _upsert_stmt(conn.dialect, table, tuple(rows[0]))
+    if stmt is not None:
+        conn.execute(stmt, rows)
+    else:
+        for values in rows:
+            _upsert(conn, table, values)
+
+def _person_values(person):
+    """Column values shared by the employees and customers tables, from an Employee or Customer"""
+    return dict(firstname=person.first_name, lastname=person.last_name, address=person.address,
+                city=person.city, state=person.state, zipcode=person.zipcode, email=person.email)
+
+def _account_values(acct:Account):
+    """Column values for the accounts table, from an Account"""
+    return dict(acctnum = acct.acct_number, owner = acct.owner, accttype = acct.type,
+                balance = acct.balance_cents, intrate = acct.interest_rate)
+
+def _credit_card_values(card:CreditCard):
+    """Column values for the creditcards table, from a CreditCard"""
+    return dict(acctnum = card.acct_number, owner = card.owner, balance = card.balance_cents,
+                intrate = card.interest_rate, opendate = card.open_date, limit = to_cents(card.credit_limit),
+                cashlimit = to_cents(card.cash_advance_limit), minpayment = to_cents(card.minimum_payment))
+
+def _loan_values(loan:Loan):
+    """Column values for the loans table, from a Loan"""
+    return dict(acctnum = loan.acct_number, owner = loan.owner, balance = loan.balance_cents,
+                intrate = loan.interest_rate, opendate = loan.open_date,
+                maturitydate = loan.maturity_date, monthlypmt = to_cents(loan.monthly_payment))
+
+@metrics.timed('datalayer')
 def employee_upsert(emp:Employee):
     """
     Adds a new or updates an existing Employee to the database.
+    An Employee whose employee number is None is inserted, and gets its new employee number assigned.
 
     Arguments:
         emp(Employee): The employee to add/update
     """
-    with engine.connect() as conn:
-        stmt = None
-        is_new_emp = False
-        if employee_srch(emp_id = emp.employee_number):
-            stmt = employees.update().where(employees.c.empid == emp.employee_number)
+    values = _person_values(emp)
+    with _connect() as conn:
+        if emp.employee_number is None:
+            result = conn.execute(_inserts[employees], values)
+            emp.employee_number = result.inserted_primary_key[0]
         else:
-            stmt = employees.insert()
-            is_new_emp = True
-        stmt = stmt.values(firstname=emp.first_name, lastname=emp.last_name, address=emp.address,
-                        city=emp.city, state=emp.state, zipcode=emp.zipcode, email=emp.email)
-        result = conn.execute(stmt)
-        if is_new_emp:
-            emp.employee_number = result.inserted_primary_key
+            _upsert(conn, employees, dict(empid=emp.employee_number, **values))
 
+@metrics.timed('datalayer', rows = True)
 def employee_srch(emp_id = None, first_name = None, last_name = None):
     """
     Finds Employees in the database.
@@ -87,45 +594,46 @@ def employee_srch(emp_id = None, first_name = None, last_name = None):
     Raises:
         ValueError: only one of first_name and last_name are specified
     """
-    with engine.connect() as conn:
-        stmt = select([employees])
+    with _connect() as conn:
         if emp_id != None:
-            stmt = stmt.where(employees.c.empid == emp_id)
+            result = conn.execute(_by_id[employees], {'id': emp_id})
         elif first_name != None and last_name != None:
-            stmt = stmt.where(and_(employees.c.firstname == first_name, employees.c.lastname == last_name))
-        elif not (emp_id == None and first_name == None and last_name == None):
+            result = conn.execute(_by_name[employees], {'first_name': first_name, 'last_name': last_name})
+        elif emp_id == None and first_name == None and last_name == None:
+            result = conn.execute(_select_all[employees])
+        else:
             raise ValueError("Please specify one of the following: no arguments, an employee ID, or both first AND last name")
-        result = conn.execute(stmt)
-        emps = []
-        for row in result:
-            emp = Employee(row['firstname'], row['lastname'], row['empid'])
-            emp.add_contact(row['address'], row['city'], row['state'], row['zipcode'], row['email'])
-            emps.append(emp)
+        emps = [Employee.from_row(row) for row in result]
         if len(emps) == 1:
             emps = emps[0]
         return emps
 
+@metrics.timed('datalayer')
 def customer_upsert(cust:Customer):
     """
     Adds a new or updates an existing Customer to the database.
+    A Customer whose customer number is None is inserted, and gets its new customer number assigned.
 
     Arguments:
         cust(Customer): The customer to add/update
     """
-    with engine.connect() as conn:
-        stmt = None
-        is_new_cust = False
-        if customer_srch(cust_id= cust.cust_number):
-            stmt = customers.update().where(customers.c.custid == cust.cust_number)
+    values = _person_values(cust)
+    old = None
+    if cust.cust_number is not None:
+        old = _row_before_write(('customer', cust.cust_number), _by_id[customers], {'id': cust.cust_number})
+    with _connect() as conn:
+        if cust.cust_number is None:
+            result = conn.execute(_inserts[customers], values)
+            cust.cust_number = result.inserted_primary_key[0]
         else:
-            stmt = customers.insert()
-            is_new_cust = True
-        stmt = stmt.values(firstname=cust.first_name, lastname=cust.last_name, address=cust.address,
-                        city=cust.city, state=cust.state, zipcode=cust.zipcode, email=cust.email)
-        result = conn.execute(stmt)
-        if is_new_cust:
-            cust.cust_number = result.inserted_primary_key
+            _upsert(conn, customers, dict(custid=cust.cust_number, **values))
+    _cache_row(('customer', cust.cust_number), customers, dict(custid=cust.cust_number, **values))
+    _cache_invalidate(('customer_name', cust.first_name, cust.last_name))
+    if old is not None:
+        # a renamed customer is no longer found under the old name
+        _cache_invalidate(('customer_name', old[1], old[2]))
 
+@metrics.timed('datalayer', rows = True)
 def customer_srch(cust_id = None, first_name = None, last_name = None):
     """
     Finds Customers in the database.
@@ -142,26 +650,25 @@ def customer_srch(cust_id = None, first_name = None, last_name = None):
     Raises:
         ValueError: only one of first_name and last_name are specified
     """
-    with engine.connect() as conn:
-        stmt = select([customers])
-        if cust_id == None and first_name == None and last_name == None:
-            pass
-        elif cust_id != None:
-            stmt = stmt.where(customers.c.custid == cust_id)
-        elif first_name != None and last_name != None:
-            stmt = stmt.where(and_(customers.c.firstname == first_name, customers.c.lastname == last_name))
-        else:
-            raise ValueError("Please specify one of the following: no arguments, a customer ID, or both first AND last name")
-        result = conn.execute(stmt)
-        custs = []
-        for row in result:
-            cust = Customer(row['firstname'], row['lastname'], row['custid'])
-            cust.add_contact(row['address'], row['city'], row['state'], row['zipcode'], row['email'])
-            custs.append(cust)
-        if len(custs) == 1:
-            custs = custs[0]
-        return custs
+    key = None
+    if cust_id != None:
+        key = ('customer', cust_id)
+    elif first_name != None and last_name != None:
+        key = ('customer_name', first_name, last_name)
+    if cust_id == None and first_name == None and last_name == None:
+        rows = _cached_rows(key, _select_all[customers])
+    elif cust_id != None:
+        rows = _cached_rows(key, _by_id[customers], {'id': cust_id})
+    elif first_name != None and last_name != None:
+        rows = _cached_rows(key, _by_name[customers], {'first_name': first_name, 'last_name': last_name})
+    else:
+        raise ValueError("Please specify one of the following: no arguments, a customer ID, or both first AND last name")
+    custs = [Customer.from_row(row) for row in rows]
+    if len(custs) == 1:
+        custs = custs[0]
+    return custs
 
+@metrics.timed('datalayer')
 def account_upsert(acct:Account):
     """
     Adds a new or updates an existing Account to the database.
@@ -169,16 +676,18 @@ def account_upsert(acct:Account):
     Arguments:
         acct(Account): The account to add/update
     """
-    with engine.connect() as conn:
-        stmt = None
-        if account_srch(acct_num = acct.acct_number):
-            stmt = accounts.update().where(accounts.c.acctnum == acct.acct_number)
-        else:
-            stmt = accounts.insert()
-        stmt = stmt.values(acctnum = acct.acct_number, owner = acct.owner, accttype = acct.type,
-                        balance = acct.balance, intrate = acct.interest_rate)
-        result = conn.execute(stmt)
-        
+    values = _account_values(acct)
+    old = _row_before_write(('account', acct.acct_number), _by_acctnum[accounts], {'acct_num': acct.acct_number})
+    with _connect() as conn:
+        with conn.begin():
+            _upsert_balance(conn, accounts, [values])
+    _cache_row(('account', acct.acct_number), accounts, values)
+    _cache_invalidate(('accounts', acct.owner))
+    if old is not None:
+        # an account moved to another owner is no longer among the old owner's
+        _cache_invalidate(('accounts', old[1]))
+
+@metrics.timed('datalayer', rows = True)
 def account_srch(acct_num = None, cust_num = None):
     """
     Finds Accounts in the database.
@@ -194,22 +703,16 @@ def account_srch(acct_num = None, cust_num = None):
     Raises:
         ValueError: neither acct_num or cust_num are specified
     """
-    with engine.connect() as conn:
-        stmt = select([accounts])
-        if acct_num != None:
-            stmt = stmt.where(accounts.c.acctnum == acct_num)
-        elif cust_num != None:
-            stmt = stmt.where(accounts.c.owner == cust_num)
-        else:
-            raise ValueError("Must specify either acct_num or cust_num to search for accounts")
-        result = conn.execute(stmt)
-        accts = []
-        for row in result:
-            acct = Account(row['owner'], row['acctnum'], row['accttype'], row['intrate'])
-            acct.deposit(row['balance'])
-            accts.append(acct)
-        return accts
+    key = _srch_key('account', acct_num, cust_num)
+    if acct_num != None:
+        rows = _cached_rows(key, _by_acctnum[accounts], {'acct_num': acct_num})
+    elif cust_num != None:
+        rows = _cached_rows(key, _by_owner[accounts], {'cust_num': cust_num})
+    else:
+        raise ValueError("Must specify either acct_num or cust_num to search for accounts")
+    return [Account.from_row(row) for row in rows]
 
+@metrics.timed('datalayer')
 def credit_card_upsert(card:CreditCard):
     """
     Adds a new or updates an existing Account to the database.
@@ -217,17 +720,18 @@ def credit_card_upsert(card:CreditCard):
     Arguments:
         acct(Account): The account to add/update
     """
-    with engine.connect() as conn:
-        stmt = None
-        if credit_card_srch(acct_num = card.acct_number):
-            stmt = credit_cards.update().where(credit_cards.c.acctnum == card.acct_number)
-        else:
-            stmt = credit_cards.insert()
-        stmt = stmt.values(acctnum = card.acct_number, owner = card.owner, balance = card.balance,
-                        intrate = card.interest_rate, opendate = card.open_date, limit = card.credit_limit,
-                        cashlimit = card.cash_advance_limit, minpayment = card.minimum_payment)
-        result = conn.execute(stmt)
-        
+    values = _credit_card_values(card)
+    old = _row_before_write(('credit_card', card.acct_number), _by_acctnum[credit_cards], {'acct_num': card.acct_number})
+    with _connect() as conn:
+        with conn.begin():
+            _upsert_balance(conn, credit_cards, [values])
+    _cache_row(('credit_card', card.acct_number), credit_cards, values)
+    _cache_invalidate(('credit_cards', card.owner))
+    if old is not None:
+        # likewise a card moved to another owner
+        _cache_invalidate(('credit_cards', old[1]))
+
+@metrics.timed('datalayer', rows = True)
 def credit_card_srch(acct_num = None, cust_num = None):
     """
     Finds CreditCards in the database.
@@ -243,19 +747,16 @@ def credit_card_srch(acct_num = None, cust_num = None):
     Raises:
         ValueError: neither acct_num or cust_num are specified
     """
-    with engine.connect() as conn:
-        stmt = select([credit_cards])
-        if acct_num != None:
-            stmt = stmt.where(credit_cards.c.acctnum == acct_num)
-        elif cust_num != None:
-            stmt = stmt.where(credit_cards.c.owner == cust_num)
-        else:
-            raise ValueError("Must specify either acct_num or cust_num to search for credit cards")
-        result = conn.execute(stmt)
-        return [CreditCard(row['owner'], row['acctnum'], row['intrate'], row['limit'], 
-                cash_advance_limit=row['cashlimit'], open_date=row['opendate'], 
-                minimum_payment=row['minpayment'], balance=row['balance']) for row in result]
+    key = _srch_key('credit_card', acct_num, cust_num)
+    if acct_num != None:
+        rows = _cached_rows(key, _by_acctnum[credit_cards], {'acct_num': acct_num})
+    elif cust_num != None:
+        rows = _cached_rows(key, _by_owner[credit_cards], {'cust_num': cust_num})
+    else:
+        raise ValueError("Must specify either acct_num or cust_num to search for credit cards")
+    return [CreditCard.from_row(row) for row in rows]
 
+@metrics.timed('datalayer')
 def loan_upsert(loan:Loan):
     """
     Adds a new or updates an existing Account to the database.
@@ -263,17 +764,18 @@ def loan_upsert(loan:Loan):
     Arguments:
         acct(Account): The account to add/update
     """
-    with engine.connect() as conn:
-        stmt = None
-        if loan_srch(acct_num = loan.acct_number):
-            stmt = loans.update().where(loans.c.acctnum == loan.acct_number)
-        else:
-            stmt = loans.insert()
-        stmt = stmt.values(acctnum = loan.acct_number, owner = loan.owner, balance = loan.balance,
-                        intrate = loan.interest_rate, opendate = loan.open_date,
-                        maturitydate = loan.maturity_date, monthlypmt = loan.monthly_payment)
-        result = conn.execute(stmt)
-    
+    values = _loan_values(loan)
+    old = _row_before_write(('loan', loan.acct_number), _by_acctnum[loans], {'acct_num': loan.acct_number})
+    with _connect() as conn:
+        with conn.begin():
+            _upsert_balance(conn, loans, [values])
+    _cache_row(('loan', loan.acct_number), loans, values)
+    _cache_invalidate(('loans', loan.owner))
+    if old is not None:
+        # likewise a loan moved to another owner
+        _cache_invalidate(('loans', old[1]))
+
+@metrics.timed('datalayer', rows = True)
 def loan_srch(acct_num = None, cust_num = None):
     """
     Finds Loans in the database.
@@ -289,24 +791,811 @@ def loan_srch(acct_num = None, cust_num = None):
     Raises:
         ValueError: neither acct_num or cust_num are specified
     """
-    with engine.connect() as conn:
-        stmt = select([loans])
-        if acct_num != None:
-            stmt = stmt.where(loans.c.acctnum == acct_num)
-        elif cust_num != None:
-            stmt = stmt.where(loans.c.owner == cust_num)
-        else:
-            raise ValueError("Must specify either acct_num or cust_num to search for credit cards")
-        result = conn.execute(stmt)
-        return [Loan(row['owner'], row['acctnum'], row['balance'], row['intrate'], row['opendate'],
-                    maturity_date=row['maturitydate'], monthly_pmt=row['monthlypmt']) for row in result]
-
-def load_accts(cust:Customer):
-    """Loads all accounts and services for the specified Customer."""
-    cust.accounts = account_srch(cust_num=cust.cust_number)
-    cards = credit_card_srch(cust_num=cust.cust_number)
-    loans = loan_srch(cust_num=cust.cust_number)
-    tmp_svcs = []
-    tmp_svcs.append(cards)
-    tmp_svcs.append(loans)
-    cust.services = [item for sublist in tmp_svcs for item in sublist]
+    key = _srch_key('loan', acct_num, cust_num)
+    if acct_num != None:
+        rows = _cached_rows(key, _by_acctnum[loans], {'acct_num': acct_num})
+    elif cust_num != None:
+        rows = _cached_rows(key, _by_owner[loans], {'cust_num': cust_num})
+    else:
+        raise ValueError("Must specify either acct_num or cust_num to search for loans")
+    return [Loan.from_row(row) for row in rows]
+
+def _debit_account(conn, acct_num, cents):
+    """Deducts cents from an account's balance, only if the balance covers it. Raises ValueError if not"""
+    result = conn.execute(_debit, {'acct_num': acct_num, 'cents': cents})
+    if result.rowcount == 0:
+        raise ValueError(f"Insufficient funds in account {acct_num}, or no such account")
+
+@metrics.timed('datalayer')
+def transfer(from_acct:Account, to_acct:Account, amount):
+    """
+    Moves money between two Accounts in one transaction: both balances change, or neither does.
+    The withdrawal and deposit are written to the ledger in the same transaction.
+    Only the database is updated; see Account.sync_balance.
+
+    Arguments:
+        from_acct(Account): the account to take the money from
+        to_acct(Account): the account to put the money into
+        amount(num): the amount to move, in dollars
+
+    Returns:
+        the balances now stored for from_acct and to_acct, in cents
+
+    Raises:
+        ValueError: amount is not positive, from_acct has insufficient funds, or either account doesn't exist
+    """
+    cents = to_cents(amount)
+    if cents <= 0:
+        raise ValueError("Transfer amount must be positive")
+    try:
+        with _connect() as conn:
+            with conn.begin():
+                _debit_account(conn, from_acct.acct_number, cents)
+                result = conn.execute(_add_to_balance[accounts], {'acct_num': to_acct.acct_number, 'delta': cents})
+                if result.rowcount == 0:
+                    raise ValueError(f"No such account {to_acct.acct_number}")
+                balances = [conn.execute(_balance_of[accounts], {'acct_num': acct.acct_number}).scalar() 
+                            for acct in (from_acct, to_acct)]
+                now = datetime.now()
+                conn.execute(transactions.insert(), [
+                    {'acctnum': from_acct.acct_number, 'kind': 'withdrawal', 'amount': -cents, 'ts': now, 'balance': balances[0]},
+                    {'acctnum': to_acct.acct_number, 'kind': 'deposit', 'amount': cents, 'ts': now, 'balance': balances[1]}])
+                return tuple(balances)
+    finally:
+        # a refused transfer means the cached balances may be out of date too
+        _cache_invalidate(('account', from_acct.acct_number), ('accounts', from_acct.owner),
+                          ('account', to_acct.acct_number), ('accounts', to_acct.owner))
+
+@metrics.timed('datalayer')
+def apply_payment(acct:Account, svc, amount):
+    """
+    Pays an amount toward a CreditCard or Loan from an Account in one transaction: 
+    the account is debited and the service credited, or neither is. Both changes are checked against the
+    balances as stored, so a payment based on an out of date service balance can't take it below zero.
+    Only the database is updated; apply the same change to the objects with Service.make_payment.
+
+    Arguments:
+        acct(Account): the source account for the payment funds
+        svc(CreditCard or Loan): the service being paid
+        amount(num): the payment amount in dollars, already limited to the service balance. A zero payment does nothing
+
+    Returns:
+        the balances now stored for the account and the service, in cents
+
+    Raises:
+        ValueError: amount is negative, it is more than the service balance as stored, 
+            the account has insufficient funds, or either one doesn't exist
+    """
+    cents = to_cents(amount)
+    if cents < 0:
+        raise ValueError("Payment amount must be positive")
+    table = credit_cards if isinstance(svc, CreditCard) else loans
+    kind = 'credit_card' if isinstance(svc, CreditCard) else 'loan'
+    try:
+        with _connect() as conn:
+            with conn.begin():
+                if cents > 0:
+                    result = conn.execute(_pay_down[table], {'acct_num': svc.acct_number, 'cents': cents})
+                    if result.rowcount == 0:
+                        raise ValueError(f"Payment is more than the balance on file for {svc.acct_number}, or no such card or loan")
+                    _debit_account(conn, acct.acct_number, cents)
+                return (conn.execute(_balance_of[accounts], {'acct_num': acct.acct_number}).scalar(),
+                        conn.execute(_balance_of[table], {'acct_num': svc.acct_number}).scalar())
+    finally:
+        # a refused payment means the cached balances may be out of date too
+        _cache_invalidate(('account', acct.acct_number), ('accounts', acct.owner),
+                          (kind, svc.acct_number), (kind + 's', svc.owner))
+
+def _change_balance(table, kind, acct, stmt, params, refused):
+    """
+    Runs a statement changing one balance relative to what is stored, and reads back the result in the same transaction.
+
+    Arguments:
+        table(Table): the table holding the balance
+        kind(str): the lookup cache kind for the table, such as 'account'
+        acct: the Account, CreditCard or Loan whose balance changes
+        stmt: the UPDATE to run
+        params(dict): its parameters
+        refused(str): the message for the ValueError raised if the UPDATE changes no row
+
+    Returns:
+        the balance now stored, in cents
+    """
+    try:
+        with _connect() as conn:
+            with conn.begin():
+                if conn.execute(stmt, params).rowcount == 0:
+                    raise ValueError(refused)
+                return conn.execute(_balance_of[table], {'acct_num': acct.acct_number}).scalar()
+    finally:
+        _cache_invalidate((kind, acct.acct_number), (kind + 's', acct.owner))
+
+@metrics.timed('datalayer')
+def account_deposit(acct:Account, amount):
+    """
+    Adds an amount to an Account's balance as stored, so any change made since the Account was loaded is kept.
+    Only the database is updated; see Account.sync_balance.
+
+    Arguments:
+        acct(Account): the account to deposit into
+        amount(num): the amount, in dollars
+
+    Returns:
+        the balance now stored, in cents
+
+    Raises:
+        ValueError: amount is negative, or the account doesn't exist
+    """
+    cents = to_cents(amount)
+    if cents < 0:
+        raise ValueError("Negative deposit not allowed")
+    return _change_balance(accounts, 'account', acct, _add_to_balance[accounts], 
+                           {'acct_num': acct.acct_number, 'delta': cents}, f"No such account {acct.acct_number}")
+
+@metrics.timed('datalayer')
+def account_withdraw(acct:Account, amount):
+    """
+    Takes an amount from an Account's balance as stored, only if the stored balance covers it.
+    Only the database is updated; see Account.sync_balance.
+
+    Arguments:
+        acct(Account): the account to withdraw from
+        amount(num): the amount, in dollars
+
+    Returns:
+        the balance now stored, in cents
+
+    Raises:
+        ValueError: amount is negative, the account has insufficient funds, or it doesn't exist
+    """
+    cents = to_cents(amount)
+    if cents < 0:
+        raise ValueError("Negative withdrawal not allowed")
+    return _change_balance(accounts, 'account', acct, _debit, {'acct_num': acct.acct_number, 'cents': cents},
+                           f"Insufficient funds in account {acct.acct_number}, or no such account")
+
+@metrics.timed('datalayer')
+def credit_card_charge(card:CreditCard, amount):
+    """
+    Adds a charge to a CreditCard's balance as stored, only if the stored balance stays within the card's limit.
+    Only the database is updated; see CreditCard.sync_balance.
+
+    Arguments:
+        card(CreditCard): the card to charge
+        amount(num): the amount, in dollars
+
+    Returns:
+        the balance now stored, in cents
+
+    Raises:
+        ValueError: amount is negative, the charge would breach the credit limit, or the card doesn't exist
+    """
+    cents = to_cents(amount)
+    if cents < 0:
+        raise ValueError("Negative charge not allowed")
+    return _change_balance(credit_cards, 'credit_card', card, _charge, {'acct_num': card.acct_number, 'cents': cents},
+                           f"Transaction declined, credit limit would be breached on card {card.acct_number}, or no such card")
+
+def _load_collection(cust_num, collection):
+    """Loads a Customer's 'accounts' or 'services'; the loader given to Customer.lazy_load"""
+    if collection == 'accounts':
+        return account_srch(cust_num=cust_num)
+    return credit_card_srch(cust_num=cust_num) + loan_srch(cust_num=cust_num)
+
+@metrics.timed('datalayer')
+def load_accts(cust:Customer, prefetch = False):
+    """
+    Loads all accounts and services for the specified Customer.
+    By default nothing is read yet: cust.accounts and cust.services are each queried the first time they are used,
+    so a session that only touches accounts never reads the credit cards and loans.
+
+    Arguments:
+        cust(Customer): the Customer to load accounts and services for
+        prefetch(bool): read both right away instead, for callers that will use both anyway
+    """
+    if not prefetch:
+        cust.lazy_load(_load_collection)
+        return
+    cust.accounts = _load_collection(cust.cust_number, 'accounts')
+    cust.services = _load_collection(cust.cust_number, 'services')
+
+def _attach_accts(conn, custs, owner_clause = None):
+    """
+    Loads accounts and services for many Customers at once: one query per table, grouped by owner in memory.
+
+    Arguments:
+        conn: the connection to query on
+        custs(list): the Customers to load accounts and services for
+        owner_clause(function): optional; takes a table and returns a WHERE clause restricting its owner column.
+            If not specified, every row of every table is read
+    """
+    accts = defaultdict(list)
+    svcs = defaultdict(list)
+    for table, from_row, groups in ((accounts, Account.from_row, accts), 
+                                    (credit_cards, CreditCard.from_row, svcs), 
+                                    (loans, Loan.from_row, svcs)):
+        stmt = select(_row_cols[table])
+        if owner_clause is not None:
+            stmt = stmt.where(owner_clause(table))
+        # the owner is the second column of every account and service table
+        for row in conn.execute(stmt):
+            groups[row[1]].append(from_row(row))
+    for cust in custs:
+        cust.accounts = accts.get(cust.cust_number, [])
+        cust.services = svcs.get(cust.cust_number, [])
+
+@metrics.timed('datalayer', rows = True)
+def load_all_customers(prefetch = True):
+    """
+    Loads every Customer, along with all of their accounts and services, in four queries total.
+
+    Arguments:
+        prefetch(bool): if False, only the customers are read, and each Customer's accounts and services
+            are loaded the first time they are used; see load_accts
+
+    Returns:
+        a list of all Customers
+    """
+    with _connect() as conn:
+        custs = [Customer.from_row(row) for row in conn.execute(_select_all[customers])]
+        if prefetch:
+            _attach_accts(conn, custs)
+    if not prefetch:
+        for cust in custs:
+            cust.lazy_load(_load_collection)
+    return custs
+
+def iter_customers(batch_size = 1000):
+    """
+    Iterates over every Customer, along with all of their accounts and services, a page at a time.
+    Pages are read in customer number order using keyset pagination, so only one page is held in memory at once,
+    and no connection is held open while the caller works through a page.
+
+    Arguments:
+        batch_size(int): Number of customers read per page
+
+    Yields:
+        each Customer, in customer number order
+    """
+    last_id = None
+    while True:
+        with _connect() as conn:
+            stmt = _select_all[customers].order_by(customers.c.custid).limit(batch_size)
+            if last_id is not None:
+                stmt = stmt.where(customers.c.custid > last_id)
+            custs = [Customer.from_row(row) for row in conn.execute(stmt)]
+            if not custs:
+                return
+            first_id, last_id = custs[0].cust_number, custs[-1].cust_number
+            _attach_accts(conn, custs, lambda table: table.c.owner.between(first_id, last_id))
+        yield from custs
+        if len(custs) < batch_size:
+            return
+
+BULK_BATCH_SIZE = 5000
+# most values put in one IN list. SQLite before 3.32 allows only 999 bound parameters in a statement,
+# and the statement may need a few others
+MAX_IN_LIST = 900
+
+def _bulk_upsert(table, objs, to_values, batch_size, id_col = None, id_attr = None, checkpoint = False):
+    """
+    Adds or updates many rows at once, using executemany in batches, all inside one transaction.
+
+    Arguments:
+        table(Table): the table to upsert into
+        objs(iterable): the domain objects to write; may be a generator, it is only consumed once
+        to_values(function): builds the column values for one object, not including id_col
+        batch_size(int): number of rows sent to the database per executemany call
+        id_col(str): for tables with a generated key, the name of the key column
+        id_attr(str): for tables with a generated key, the object attribute holding the key. 
+            Objects where this is None are inserted one at a time, so they can get their new key assigned
+        checkpoint(bool): for accounts, creditcards and loans: ledger balances overwritten, and checkpoint every balance
+            written, so as_of_balance has a starting point for new rows too. See _upsert_balance
+
+    Returns:
+        the number of rows written
+    """
+    written = 0
+    objs = iter(objs)
+    now = datetime.now()
+    with _connect() as conn:
+        with conn.begin():
+            batch = list(islice(objs, batch_size))
+            while batch:
+                rows = []
+                for obj in batch:
+                    values = to_values(obj)
+                    if id_attr is None:
+                        rows.append(values)
+                    elif getattr(obj, id_attr) is None:
+                        result = conn.execute(table.insert().values(**values))
+                        setattr(obj, id_attr, result.inserted_primary_key[0])
+                    else:
+                        rows.append({id_col: getattr(obj, id_attr), **values})
+                if rows and checkpoint:
+                    _upsert_balance(conn, table, rows, now)
+                    _write_checkpoints(conn, [(values['acctnum'], values['balance']) for values in rows], now)
+                elif rows:
+                    stmt = _upsert_stmt(conn.dialect, table, tuple(rows[0]))
+                    if stmt is not None:
+                        conn.execute(stmt, rows)
+                    else:
+                        for values in rows:
+                            _upsert(conn, table, values)
+                written += len(batch)
+                batch = list(islice(objs, batch_size))
+    _cache_clear()
+    return written
+
+@metrics.timed('datalayer')
+def employees_bulk_upsert(emps, batch_size = BULK_BATCH_SIZE):
+    """
+    Adds or updates many Employees in one transaction. See employee_upsert
+
+    Arguments:
+        emps(iterable): The employees to add/update
+        batch_size(int): Number of rows written per batch
+
+    Returns:
+        the number of employees written
+    """
+    return _bulk_upsert(employees, emps, _person_values, batch_size, id_col = 'empid', id_attr = 'employee_number')
+
+@metrics.timed('datalayer')
+def customers_bulk_upsert(custs, batch_size = BULK_BATCH_SIZE):
+    """
+    Adds or updates many Customers in one transaction. See customer_upsert
+
+    Arguments:
+        custs(iterable): The customers to add/update
+        batch_size(int): Number of rows written per batch
+
+    Returns:
+        the number of customers written
+    """
+    return _bulk_upsert(customers, custs, _person_values, batch_size, id_col = 'custid', id_attr = 'cust_number')
+
+@metrics.timed('datalayer')
+def accounts_bulk_upsert(accts, batch_size = BULK_BATCH_SIZE):
+    """
+    Adds or updates many Accounts in one transaction. Every balance written is checkpointed.
+
+    Arguments:
+        accts(iterable): The accounts to add/update
+        batch_size(int): Number of rows written per batch
+
+    Returns:
+        the number of accounts written
+    """
+    return _bulk_upsert(accounts, accts, _account_values, batch_size, checkpoint = True)
+
+@metrics.timed('datalayer')
+def credit_cards_bulk_upsert(cards, batch_size = BULK_BATCH_SIZE):
+    """
+    Adds or updates many CreditCards in one transaction. Every balance written is checkpointed.
+
+    Arguments:
+        cards(iterable): The credit cards to add/update
+        batch_size(int): Number of rows written per batch
+
+    Returns:
+        the number of credit cards written
+    """
+    return _bulk_upsert(credit_cards, cards, _credit_card_values, batch_size, checkpoint = True)
+
+@metrics.timed('datalayer')
+def loans_bulk_upsert(loans_to_write, batch_size = BULK_BATCH_SIZE):
+    """
+    Adds or updates many Loans in one transaction. Every balance written is checkpointed.
+
+    Arguments:
+        loans_to_write(iterable): The loans to add/update
+        batch_size(int): Number of rows written per batch
+
+    Returns:
+        the number of loans written
+    """
+    return _bulk_upsert(loans, loans_to_write, _loan_values, batch_size, checkpoint = True)
+
+@metrics.timed('datalayer')
+def transactions_bulk_insert(rows, batch_size = BULK_BATCH_SIZE):
+    """
+    Appends many entries to the transactions ledger, in batches inside one transaction.
+
+    Arguments:
+        rows(iterable): (acctnum, kind, amount, ts, balance) tuples; may be a generator
+        batch_size(int): Number of rows written per batch
+
+    Returns:
+        the number of rows written
+    """
+    stmt = transactions.insert()
+    written = 0
+    rows = iter(rows)
+    with _connect() as conn:
+        with conn.begin():
+            batch = [dict(zip(('acctnum', 'kind', 'amount', 'ts', 'balance'), row)) for row in islice(rows, batch_size)]
+            while batch:
+                conn.execute(stmt, batch)
+                written += len(batch)
+                batch = [dict(zip(('acctnum', 'kind', 'amount', 'ts', 'balance'), row)) for row in islice(rows, batch_size)]
+    return written
+
+@metrics.timed('datalayer', rows = True)
+def transaction_srch(acct_num, since = None, until = None):
+    """
+    Finds the ledger entries for an account, credit card or loan, oldest first.
+
+    Arguments:
+        acct_num (int): The account number to search for
+        since (datetime): Optional; only entries after this time
+        until (datetime): Optional; only entries at or before this time
+
+    Returns:
+        a list of (acctnum, kind, amount, ts, balance) rows
+    """
+    stmt = select([transactions.c.acctnum, transactions.c.kind, transactions.c.amount, 
+                   transactions.c.ts, transactions.c.balance]).where(transactions.c.acctnum == acct_num)
+    if since is not None:
+        stmt = stmt.where(transactions.c.ts > since)
+    if until is not None:
+        stmt = stmt.where(transactions.c.ts <= until)
+    with _connect() as conn:
+        return [tuple(row) for row in conn.execute(stmt.order_by(transactions.c.ts, transactions.c.txnid))]
+
+def _ledger_interest(conn, table, new_bal, where, ts):
+    """Appends an 'interest' ledger entry for every row of table whose balance the month-end update will change"""
+    cond = new_bal != table.c.balance
+    if where is not None:
+        cond = and_(where, cond)
+    conn.execute(transactions.insert().from_select(['acctnum', 'kind', 'amount', 'ts', 'balance'],
+        select([table.c.acctnum, literal('interest'), new_bal - table.c.balance, literal(ts, DateTime), new_bal]).where(cond)))
+
+def _checkpoint(conn, table, ts, where = None):
+    """
+    Checkpoints the balance of every row of table that has never been checkpointed, has ledger entries
+    since its last checkpoint, or whose balance no longer matches its last checkpoint (changed outside the ledger).
+    Other rows keep their last checkpoint, which is still current. where optionally limits which rows of table are considered
+    """
+    last_ts = select([func.max(balance_checkpoints.c.ts)]).where(balance_checkpoints.c.acctnum == table.c.acctnum).as_scalar()
+    last_balance = select([balance_checkpoints.c.balance]).where(balance_checkpoints.c.acctnum == table.c.acctnum) \
+                   .order_by(balance_checkpoints.c.ts.desc()).limit(1).as_scalar()
+    active = exists().where(and_(transactions.c.acctnum == table.c.acctnum, transactions.c.ts > last_ts))
+    cond = or_(last_ts == None, active, last_balance != table.c.balance)
+    if where is not None:
+        cond = and_(where, cond)
+    conn.execute(balance_checkpoints.insert().from_select(['acctnum', 'ts', 'balance'],
+        select([table.c.acctnum, literal(ts, DateTime), table.c.balance]).where(cond)))
+
+@metrics.timed('datalayer')
+def as_of_balance(acct_num, ts):
+    """
+    Finds the balance of an account, credit card or loan as of a point in time.
+    Starts from the latest balance checkpoint at or before ts, and adds only the ledger entries after it.
+    With no checkpoint that early, works back instead from the earliest checkpoint after ts, or the current balance
+    if there is none, taking off the ledger entries between ts and that point.
+
+    Arguments:
+        acct_num (int): The account number
+        ts (datetime): The point in time
+
+    Returns:
+        the balance as of ts, in cents
+    """
+    with _connect() as conn:
+        checkpoint = conn.execute(select([balance_checkpoints.c.ts, balance_checkpoints.c.balance])
+                                  .where(and_(balance_checkpoints.c.acctnum == acct_num, balance_checkpoints.c.ts <= ts))
+                                  .order_by(balance_checkpoints.c.ts.desc()).limit(1)).first()
+        ledger_sum = select([func.coalesce(func.sum(transactions.c.amount), 0)]).where(transactions.c.acctnum == acct_num)
+        if checkpoint is not None:
+            start_ts, balance = checkpoint
+            return balance + conn.execute(ledger_sum.where(and_(transactions.c.ts > start_ts, transactions.c.ts <= ts))).scalar()
+        later = conn.execute(select([balance_checkpoints.c.ts, balance_checkpoints.c.balance])
+                             .where(and_(balance_checkpoints.c.acctnum == acct_num, balance_checkpoints.c.ts > ts))
+                             .order_by(balance_checkpoints.c.ts).limit(1)).first()
+        if later is not None:
+            end_ts, balance = later
+            return balance - conn.execute(ledger_sum.where(and_(transactions.c.ts > ts, transactions.c.ts <= end_ts))).scalar()
+        balance = 0
+        for table in (accounts, credit_cards, loans):
+            current = conn.execute(_balance_of[table], {'acct_num': acct_num}).scalar()
+            if current is not None:
+                balance = current
+                break
+        return balance - conn.execute(ledger_sum.where(transactions.c.ts > ts)).scalar()
+
+def _with_interest(table):
+    """SQL expression for a table's balance after one month of interest, rounded to the cent like money.round_cents"""
+    return cast(func.round(table.c.balance * (1 + table.c.intrate / 1200.0)), Integer)
+
+def _owner_range(table, lo, hi):
+    """SQL condition for rows of table whose owner is from lo (inclusive) to hi (exclusive); None for either means unbounded"""
+    conds = []
+    if lo is not None:
+        conds.append(table.c.owner >= lo)
+    if hi is not None:
+        conds.append(table.c.owner < hi)
+    return and_(*conds) if conds else None
+
+def _accrual_due(table, period):
+    """
+    SQL condition for rows of table still due a month of interest for period: interest-bearing accounts,
+    or any credit card, that haven't accrued for this period or a later one
+    """
+    due = or_(table.c.lastaccrual == None, table.c.lastaccrual < period)
+    return and_(table.c.intrate > 0, due) if table is accounts else due
+
+def _accrue(conn, table, period, where, ts):
+    """
+    Applies a month of interest to the rows of table due it for period, limited by where,
+    with ledger entries, and marks them as accrued for period. Runs on conn, in the caller's transaction.
+
+    Returns:
+        a tuple of the number of rows and the total interest, in cents
+    """
+    cond = _accrual_due(table, period)
+    if where is not None:
+        cond = and_(cond, where)
+    new_bal = _with_interest(table)
+    count, interest = conn.execute(select([func.count(), 
+        func.coalesce(func.sum(new_bal - table.c.balance), 0)]).where(cond)).first()
+    _ledger_interest(conn, table, new_bal, cond, ts)
+    conn.execute(table.update().where(cond).values(balance = new_bal, lastaccrual = period))
+    return count, interest
+
+def _start_month_end_run(conn, period):
+    """Registers a month-end run for period, if it isn't already. Returns the run's row"""
+    this_run = month_end_runs.c.period == period
+    run = conn.execute(select([month_end_runs]).where(this_run)).first()
+    if run is None:
+        conn.execute(month_end_runs.insert().values(period = period, started = datetime.now(), batches = 0,
+                                                    accounts = 0, creditcards = 0, acctinterest = 0, cardinterest = 0))
+        run = conn.execute(select([month_end_runs]).where(this_run)).first()
+    return run
+
+def _add_to_month_end_run(conn, period, acct_ctr, acct_int, card_ctr, card_int):
+    """Adds one committed batch's counts and totals to a period's run, in the batch's transaction"""
+    conn.execute(month_end_runs.update().where(month_end_runs.c.period == period)
+                 .values(batches = month_end_runs.c.batches + 1,
+                         accounts = month_end_runs.c.accounts + acct_ctr, creditcards = month_end_runs.c.creditcards + card_ctr,
+                         acctinterest = month_end_runs.c.acctinterest + acct_int,
+                         cardinterest = month_end_runs.c.cardinterest + card_int))
+
+def _month_end_results(run, already_run):
+    """The dict month_end_interest returns, from a month_end_runs row"""
+    return {'period': run['period'], 'accounts': run['accounts'], 'credit_cards': run['creditcards'],
+            'account_interest': run['acctinterest'] / 100, 'credit_card_interest': run['cardinterest'] / 100,
+            'batches': run['batches'], 'already_run': already_run}
+
+def month_end_period(when = None):
+    """The month-end period a point in time falls in, as 'YYYY-MM'. Defaults to now"""
+    return (when or datetime.now()).strftime('%Y-%m')
+
+def _check_period(period):
+    """
+    Raises ValueError unless period is a month written exactly as 'YYYY-MM'. Periods are compared as strings,
+    so anything else, such as '2030-1', would sort out of order and skip or repeat months
+    """
+    try:
+        valid = datetime.strptime(period, '%Y-%m').strftime('%Y-%m') == period
+    except (TypeError, ValueError):
+        valid = False
+    if not valid:
+        raise ValueError(f"Month-end period must be written as YYYY-MM, not {period!r}")
+
+@metrics.timed('datalayer')
+def interest_bulk_apply(table, rows, period, batch_size = BULK_BATCH_SIZE):
+    """
+    Applies interest worked out outside the database, such as by portfolio.Portfolio.accrue, to many accounts
+    or credit cards the way month_end_interest does: added to the stored balance, with an 'interest' ledger entry,
+    and the row marked as accrued for period. Rows that already accrued interest for period, or a later one,
+    are left alone, so no period is ever paid twice.
+
+    Arguments:
+        table(Table): accounts or credit_cards
+        rows(iterable): (account number, interest in cents) pairs; may be a generator
+        period(str): the month-end period the interest is for, as 'YYYY-MM'
+        batch_size(int): Number of rows written per transaction
+
+    Returns:
+        the number of rows updated
+
+    Raises:
+        ValueError: period is not written as 'YYYY-MM'
+    """
+    _check_period(period)
+    due = _accrual_due(table, period)
+    stmt = table.update().where(and_(table.c.acctnum == bindparam('acct_num'), due)) \
+                .values(balance = table.c.balance + bindparam('interest'), lastaccrual = literal(period))
+    written = 0
+    rows = iter(rows)
+    with _connect() as conn:
+        batch = dict(islice(rows, batch_size))
+        while batch:
+            acct_nums = list(batch)
+            with conn.begin():
+                due_nums = []
+                for start in range(0, len(acct_nums), MAX_IN_LIST):
+                    in_chunk = table.c.acctnum.in_(acct_nums[start:start + MAX_IN_LIST])
+                    # writing first locks the rows, so a month-end running alongside can't accrue them in between
+                    conn.execute(table.update().where(in_chunk).values(balance = table.c.balance))
+                    due_nums += [row[0] for row in conn.execute(select([table.c.acctnum]).where(and_(in_chunk, due)))]
+                if due_nums:
+                    conn.execute(stmt, [{'acct_num': acct_num, 'interest': batch[acct_num]} for acct_num in due_nums])
+                    now = datetime.now()
+                    for start in range(0, len(due_nums), MAX_IN_LIST):
+                        new_bals = conn.execute(select([table.c.acctnum, table.c.balance])
+                                                .where(table.c.acctnum.in_(due_nums[start:start + MAX_IN_LIST])))
+                        conn.execute(transactions.insert(), [dict(acctnum = acct_num, kind = 'interest', amount = batch[acct_num], 
+                                                                  ts = now, balance = balance) for acct_num, balance in new_bals])
+                written += len(due_nums)
+            batch = dict(islice(rows, batch_size))
+    _cache_clear()
+    return written
+
+@metrics.timed('datalayer')
+def month_end_interest(period = None, batch_size = BULK_BATCH_SIZE):
+    """
+    Applies monthly interest to every interest-bearing Account and every CreditCard in the database.
+    The rate is the annual rate / 12, and new balances are rounded to the cent, same as Account.pay_interest
+    and CreditCard.charge_interest. Every balance that changes also gets an 'interest' entry in the transactions ledger.
+
+    The run is idempotent and resumable. Each account and card records the last period it accrued interest for,
+    and is only updated if that is before period. Rows are updated batch_size at a time, each batch in its own
+    transaction together with the run's progress in month_end_runs. Running a period again after a crash
+    picks up after the last committed batch; running a period that already finished changes nothing.
+    Once every batch is done, every account, card and loan with ledger activity since its last balance
+    checkpoint gets a new one, and the run is marked finished.
+
+    Arguments:
+        period (str): the month-end period, as 'YYYY-MM'. Defaults to the current month, see month_end_period
+        batch_size (int): Number of accounts or cards updated per transaction
+
+    Returns:
+        a dict with the 'period', the number of accounts and credit cards updated by the run ('accounts', 'credit_cards'),
+        the total interest paid/charged on each in dollars ('account_interest', 'credit_card_interest'),
+        the number of batches it took ('batches'), and whether the period had already finished before this call ('already_run')
+
+    Raises:
+        ValueError: period is not written as 'YYYY-MM'
+    """
+    period = period or month_end_period()
+    _check_period(period)
+    this_run = month_end_runs.c.period == period
+    with _connect() as conn:
+        with conn.begin():
+            run = _start_month_end_run(conn, period)
+        if run['finished'] is not None:
+            return _month_end_results(run, True)
+        for table in (accounts, credit_cards):
+            # batches are keyed on acctnum: each one starts after the last row of the one before, so rows already
+            # done are never scanned again. The first batch finds where an interrupted run left off
+            prev = None
+            while True:
+                with conn.begin():
+                    # writing first takes the database write lock up front, so two runs can't both take a batch
+                    conn.execute(month_end_runs.update().where(this_run).values(batches = month_end_runs.c.batches))
+                    due = _accrual_due(table, period)
+                    if prev is not None:
+                        due = and_(table.c.acctnum > prev, due)
+                    # the last row of this batch, or None if every remaining row fits in it
+                    last = conn.execute(select([table.c.acctnum]).where(due)
+                                        .order_by(table.c.acctnum).limit(1).offset(batch_size - 1)).scalar()
+                    where = table.c.acctnum > prev if prev is not None else None
+                    if last is not None:
+                        where = and_(where, table.c.acctnum <= last) if where is not None else table.c.acctnum <= last
+                    count, interest = _accrue(conn, table, period, where, datetime.now())
+                    if count:
+                        if table is accounts:
+                            _add_to_month_end_run(conn, period, count, interest, 0, 0)
+                        else:
+                            _add_to_month_end_run(conn, period, 0, 0, count, interest)
+                if last is None:
+                    break
+                prev = last
+        with conn.begin():
+            now = datetime.now()
+            for table in (accounts, credit_cards, loans):
+                _checkpoint(conn, table, now)
+            conn.execute(month_end_runs.update().where(and_(this_run, month_end_runs.c.finished == None))
+                         .values(finished = now))
+            run = conn.execute(select([month_end_runs]).where(this_run)).first()
+    _cache_clear()
+    return _month_end_results(run, False)
+
+def plan_month_end_shards(period, num_shards):
+    """
+    Splits the customer number keyspace into shards of about equal numbers of customers, for a sharded month-end,
+    and registers the period's run in month_end_runs.
+    The plan is saved, so re-running a period (for example after a crash) reuses the same shards
+    even if customers have been added since; num_shards is ignored when a plan already exists.
+
+    Arguments:
+        period (str): the month-end period, see month_end_period
+        num_shards (int): number of shards to split into
+
+    Returns:
+        a list of (shard, lo, hi) tuples; each shard covers owners from lo (inclusive) to hi (exclusive),
+        and None means unbounded
+
+    Raises:
+        ValueError: period is not written as 'YYYY-MM'
+    """
+    _check_period(period)
+    shard_cols = [month_end_shards.c.shard, month_end_shards.c.lo, month_end_shards.c.hi]
+    with _connect() as conn:
+        with conn.begin():
+            _start_month_end_run(conn, period)
+            plan = conn.execute(select(shard_cols).where(month_end_shards.c.period == period)
+                                .order_by(month_end_shards.c.shard)).fetchall()
+            if plan:
+                return [tuple(row) for row in plan]
+            num_custs = conn.execute(select([func.count()]).select_from(customers)).scalar()
+            bounds = []
+            for shard in range(1, num_shards):
+                bound = conn.execute(select([customers.c.custid]).order_by(customers.c.custid)
+                                     .limit(1).offset(shard * num_custs // num_shards)).scalar()
+                if bound is not None and (not bounds or bound > bounds[-1]):
+                    bounds.append(bound)
+            edges = [None] + bounds + [None]
+            plan = [(shard, edges[shard], edges[shard + 1]) for shard in range(len(edges) - 1)]
+            conn.execute(month_end_shards.insert(), [dict(period = period, shard = shard, lo = lo, hi = hi) 
+                                                     for shard, lo, hi in plan])
+    return plan
+
+@metrics.timed('datalayer')
+def month_end_shard(period, shard):
+    """
+    Applies monthly interest, as month_end_interest does, to the accounts and cards in one shard of a period's plan.
+    The interest, the shard's completion and its share of the run's totals are committed together, 
+    so a shard that already completed for this period is skipped rather than applied again.
+    The shard that completes last marks the period's run finished.
+
+    Arguments:
+        period (str): the month-end period, see month_end_period
+        shard (int): the shard number, from plan_month_end_shards
+
+    Returns:
+        a dict with the shard's 'shard', 'lo', 'hi', the number of accounts and credit cards affected ('accounts', 'credit_cards'),
+        the total interest on each in dollars ('account_interest', 'credit_card_interest'), how long it took ('seconds'),
+        and whether it had already completed ('skipped'); a skipped shard reports the results of the run that completed it
+
+    Raises:
+        ValueError: period is not written as 'YYYY-MM', or the shard is not in the period's plan
+    """
+    _check_period(period)
+    start = time.perf_counter()
+    this_shard = and_(month_end_shards.c.period == period, month_end_shards.c.shard == shard)
+    with _connect() as conn:
+        with conn.begin():
+            # writing first takes the database write lock up front, so two runners can't both apply a shard
+            claimed = conn.execute(month_end_shards.update()
+                                   .where(and_(this_shard, month_end_shards.c.completed == None))
+                                   .values(seconds = 0)).rowcount
+            row = conn.execute(select([month_end_shards]).where(this_shard)).first()
+            if row is None:
+                raise ValueError(f"Shard {shard} is not in the month-end plan for {period}")
+            skipped = not claimed
+            if not skipped:
+                now = datetime.now()
+                acct_ctr, acct_int = _accrue(conn, accounts, period, _owner_range(accounts, row['lo'], row['hi']), now)
+                card_ctr, card_int = _accrue(conn, credit_cards, period, _owner_range(credit_cards, row['lo'], row['hi']), now)
+                for table in (accounts, credit_cards, loans):
+                    _checkpoint(conn, table, now, _owner_range(table, row['lo'], row['hi']))
+                _add_to_month_end_run(conn, period, acct_ctr, acct_int, card_ctr, card_int)
+                conn.execute(month_end_shards.update().where(this_shard)
+                             .values(accounts = acct_ctr, creditcards = card_ctr, acctinterest = acct_int,
+                                     cardinterest = card_int, seconds = time.perf_counter() - start,
+                                     completed = datetime.now()))
+                pending = conn.execute(select([func.count()]).where(and_(month_end_shards.c.period == period,
+                                                                         month_end_shards.c.completed == None))).scalar()
+                if not pending:
+                    conn.execute(month_end_runs.update().where(and_(month_end_runs.c.period == period, 
+                                                                    month_end_runs.c.finished == None))
+                                 .values(finished = datetime.now()))
+                row = conn.execute(select([month_end_shards]).where(this_shard)).first()
+    if not skipped:
+        _cache_clear()
+    return {'shard': shard, 'lo': row['lo'], 'hi': row['hi'], 'accounts': row['accounts'], 'credit_cards': row['creditcards'],
+            'account_interest': row['acctinterest'] / 100, 'credit_card_interest': row['cardinterest'] / 100,
+            'seconds': row['seconds'], 'skipped': skipped}
@@ -1,9 +1,12 @@
 from datalayer import *
+import argparse
+import banking
 import logging
+import profiling
 
 def set_up_employee(first_name, last_name):
     """
-    Interactively builds an employee record.
+    Interactively sets up and saves an employee record.
 
     Arguments:
         first_name(str): the employee's first name
@@ -17,12 +20,10 @@ def set_up_employee(first_name, last_name):
     state = input("What state do you live in (2-letter postal abbreviation please)? ")
     zipcode = input("What is your zipcode (5 numbers only please)? ")
     email = input("And finally, what is your email? ")
-    new_emp = Employee(first_name, last_name, 999)
-    new_emp.add_contact(addr, city, state, zipcode, email)
-    return new_emp
+    return banking.register_employee(first_name, last_name, addr, city, state, zipcode, email)
 
 def view_accts():
-    for cust in customers:
+    for cust in iter_customers():
         header = f"Accounts for {cust.first_name} {cust.last_name}:"
         header_deco = '=' * len(header)
         print(header_deco)
@@ -42,47 +43,42 @@ def view_accts():
     print('=' * 20)
 
 def run_month_end():
-    acct_ctr = 0
-    svc_ctr = 0
-    for cust in customers:
-        for acct in cust.accounts:
-            if acct.interest_rate > 0:
-                new_bal = acct.pay_interest()
-                account_upsert(acct)
-                logging.info(f"Interest paid on account {acct.acct_number}, new balance ${round(new_bal, 2)}")
-                acct_ctr += 1
-        for svc in cust.services:
-            if type(svc) == CreditCard:
-                new_bal = svc.charge_interest()
-                credit_card_upsert(svc)
-                logging.info(f"Interest charged on card {svc.acct_number}, new balance ${round(new_bal, 2)}")
-                svc_ctr += 1
-    print(f"Month end process complete. {acct_ctr} accounts and {svc_ctr} credit cards affected. See transaction log for details.")
+    with profiling.profiled("month-end"):
+        results = banking.run_month_end()
+    if results['already_run']:
+        print(f"Month end for {results['period']} has already been run, so no interest was applied.")
+        return
+    print(f"Month end process complete. {results['accounts']} accounts and {results['credit_cards']} credit cards affected. See transaction log for details.")
 
-logging.basicConfig(filename="transaction.log", level=logging.INFO, 
-                    format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p")
-fname = input("What is your first name? ")
-lname = input("What is your last name? ")
-emp = employee_srch(first_name=fname, last_name=lname)
-if not emp:
-    print("I didn't find you, let's set you up.")
-    emp = set_up_employee(fname, lname)
-    employee_upsert(emp)
-    print(f"Thanks {fname}! You're all set up, your employee number is {emp.employee_number}")
-else:
-    print(f"Welcome back, {fname}!")
+def main():
+    """Runs an interactive session for one employee"""
+    parser = argparse.ArgumentParser(description="Employee interface for the simple banking system")
+    parser.add_argument("--profile", action="store_true", help="profile each month-end run, see profiling.py")
+    if parser.parse_args().profile:
+        profiling.enable()
+    logging.basicConfig(filename="transaction.log", level=logging.INFO, 
+                        format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p")
+    fname = input("What is your first name? ")
+    lname = input("What is your last name? ")
+    emp = banking.find_employee(fname, lname)
+    if not emp:
+        print("I didn't find you, let's set you up.")
+        emp = set_up_employee(fname, lname)
+        print(f"Thanks {fname}! You're all set up, your employee number is {emp.employee_number}")
+    else:
+        print(f"Welcome back, {fname}!")
 
-customers = customer_srch()
-for cust in customers:
-    load_accts(cust)
-selection = 1
-choices = {1: view_accts, 2: run_month_end, 0: lambda: ""}
-while selection != 0:
-    print("What would you like to do?")
-    print("1. View all accounts")
-    print("2. Apply interest to all accounts")
-    print("0. Exit")
-    selection = int(input(">> "))
-    action = choices.get(selection, lambda: print("Sorry, that isn't one of the choices, please try again."))
-    action()
-print("Thank you. Goodbye")
+    selection = 1
+    choices = {1: view_accts, 2: run_month_end, 0: lambda: ""}
+    while selection != 0:
+        print("What would you like to do?")
+        print("1. View all accounts")
+        print("2. Apply interest to all accounts")
+        print("0. Exit")
+        selection = int(input(">> "))
+        action = choices.get(selection, lambda: print("Sorry, that isn't one of the choices, please try again."))
+        action()
+    print("Thank you. Goodbye")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+from collections import namedtuple
+from datetime import datetime
+import atexit
+import logging
+import queue
+import threading
+import time
+import datalayer as dl
+
+# one entry in the transactions ledger. amount is the signed change to the balance, and balance is the
+# resulting balance, both in cents
+Transaction = namedtuple('Transaction', ['acct_number', 'kind', 'amount', 'timestamp', 'balance'])
+
+_STOP = object()
+
+class LedgerWriter:
+    """
+    Buffers ledger entries in memory and appends them to the transactions table from a background thread,
+    in batches, so recording a transaction never waits on the database.
+
+    Attributes:
+        max_batch (int): A batch is written as soon as this many entries are waiting
+        flush_interval (num): Otherwise, waiting entries are written after at most this many seconds
+        written (int): Number of entries written to the database so far
+
+    Methods:
+        record: Queue an entry
+        flush: Write everything queued so far, and wait for it
+        close: Flush, then stop the background thread. After that, record and flush raise ValueError
+    """
+    def __init__(self, max_batch = 500, flush_interval = 1.0):
+        """
+        Creates a LedgerWriter and starts its background thread.
+
+        Args:
+            max_batch (int): Number of waiting entries that triggers a write
+            flush_interval (num): Most seconds an entry waits before it is written
+        """
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.written = 0
+        self._queue = queue.Queue()
+        self._closed = False
+        # held while queueing, so nothing is queued behind the stop that close puts on the queue
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, acct_number, kind, amount, balance, timestamp = None):
+        """
+        Queues a ledger entry to be written.
+
+        Args:
+            acct_number (int): The account, credit card or loan number
+            kind (str): deposit, withdrawal, charge, payment, interest, open or adjustment
+            amount (int): The signed change to the balance, in cents
+            balance (int): The balance after the change, in cents
+            timestamp (datetime): When it happened. Defaults to now
+
+        Returns:
+            the queued Transaction
+
+        Raises:
+            ValueError: the writer is closed, so the entry would never be written
+        """
+        entry = Transaction(acct_number, kind, amount, timestamp or datetime.now(), balance)
+        self._put(entry)
+        return entry
+
+    def flush(self):
+        """
+        Writes every entry queued so far, returning once they are in the database
+
+        Raises:
+            ValueError: the writer is closed; close already wrote everything queued before it
+        """
+        done = threading.Event()
+        self._put(done)
+        done.wait()
+
+    def close(self):
+        """Writes every entry queued so far, then stops the background thread. Closing again does nothing"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join()
+
+    def _put(self, item):
+        with self._lock:
+            if self._closed:
+                raise ValueError("The ledger writer is closed")
+            self._queue.put(item)
+
+    def _write(self, pending):
+        """Writes pending entries; if that fails they are kept, to try again with the next batch"""
+        try:
+            self.written += dl.transactions_bulk_insert(pending)
+            pending.clear()
+        except Exception:
+            logging.exception(f"Could not write {len(pending)} ledger entries, will retry")
+
+    def _run(self):
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if isinstance(item, Transaction):
+                pending.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+                if len(pending) < self.max_batch:
+                    continue
+            if pending:
+                self._write(pending)
+            deadline = time.monotonic() + self.flush_interval if pending else None
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    """The shared LedgerWriter, started on first use and flushed when the program exits"""
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = LedgerWriter()
+            atexit.register(_writer.close)
+        return _writer
+
+def record(acct_number, kind, amount, balance, timestamp = None):
+    """Queues a ledger entry on the shared LedgerWriter, and returns it. See LedgerWriter.record"""
+    return get_writer().record(acct_number, kind, amount, balance, timestamp)
+
+def history(acct_number, since = None, until = None):
+    """
+    The ledger entries for an account, credit card or loan, oldest first.
+    Only entries already written to the database are included; flush the writer first to include everything.
+
+    Arguments:
+        acct_number (int): The account number
+        since (datetime): Optional; only entries after this time
+        until (datetime): Optional; only entries at or before this time
+
+    Returns:
+        a list of Transactions
+    """
+    return [Transaction._make(row) for row in dl.transaction_srch(acct_number, since, until)]
@@ -0,0 +1,228 @@
+"""
+In-process instrumentation for the simple banking system.
+Datalayer functions and banking actions are wrapped with timed(), which records how many times each was called,
+how long the calls took, how many failed and, for searches, how many rows they returned. instrument_engine
+adds database-level counters (connections opened, statements run, rows written, statement time)
+and an optional slow-query log. Everything is recorded in a Registry that can be dumped as
+Prometheus text or JSON; set_registry plugs in a different one, for example one that forwards to another system.
+"""
+from collections import defaultdict
+from sqlalchemy import event
+import atexit
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+slow_query_log = logging.getLogger("datalayer.slow")
+
+class Registry:
+    """
+    Holds counters and timers, each identified by a metric name and a set of labels.
+
+    Methods:
+        incr: Add to a counter
+        observe: Record one timed event
+        snapshot: Every counter and timer, as plain data
+        reset: Forget everything recorded so far
+        to_prometheus: Every metric in Prometheus text exposition format
+        to_json: Every metric as JSON
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        # (name, labels) -> [count, total seconds, max seconds]
+        self._timers = {}
+
+    def incr(self, name, value = 1, **labels):
+        """Adds value to the counter name with the given labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def observe(self, name, seconds, **labels):
+        """Records one event taking seconds in the timer name with the given labels"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self._timers.get(key)
+            if timer is None:
+                self._timers[key] = [1, seconds, seconds]
+            else:
+                timer[0] += 1
+                timer[1] += seconds
+                if seconds > timer[2]:
+                    timer[2] = seconds
+
+    def snapshot(self):
+        """
+        Returns:
+            a dict with 'counters', a list of {name, labels, value}, and 'timers', a list of
+            {name, labels, count, sum, max} with times in seconds
+        """
+        with self._lock:
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+            timers = [{'name': name, 'labels': dict(labels), 'count': count, 'sum': total, 'max': longest}
+                      for (name, labels), (count, total, longest) in sorted(self._timers.items())]
+        return {'counters': counters, 'timers': timers}
+
+    def reset(self):
+        """Forgets every counter and timer"""
+        with self._lock:
+            self._counters.clear()
+            self._timers.clear()
+
+    def to_prometheus(self):
+        """
+        Returns:
+            every metric in Prometheus text exposition format. Counters are exposed as counters,
+            and timers as summaries (name_count, name_sum) with a name_max gauge
+        """
+        snap = self.snapshot()
+        lines = []
+        typed = set()
+        for counter in snap['counters']:
+            if counter['name'] not in typed:
+                lines.append(f"# TYPE {counter['name']} counter")
+                typed.add(counter['name'])
+            lines.append(f"{counter['name']}{_prom_labels(counter['labels'])} {_prom_value(counter['value'])}")
+        for timer in snap['timers']:
+            name, labels = timer['name'], _prom_labels(timer['labels'])
+            if name not in typed:
+                lines.append(f"# TYPE {name} summary")
+                typed.add(name)
+            lines.append(f"{name}_count{labels} {timer['count']}")
+            lines.append(f"{name}_sum{labels} {timer['sum']:.6f}")
+        for timer in snap['timers']:
+            name = timer['name'] + '_max'
+            if name not in typed:
+                lines.append(f"# TYPE {name} gauge")
+                typed.add(name)
+            lines.append(f"{name}{_prom_labels(timer['labels'])} {timer['max']:.6f}")
+        return '\n'.join(lines) + '\n'
+
+    def to_json(self):
+        """Every metric as a JSON string; see snapshot"""
+        return json.dumps(self.snapshot(), indent = 2)
+
+def _prom_value(value):
+    # exact, unlike :g, which keeps only 6 significant digits and so hides small increments of a large counter.
+    # Counters are floats, but most only ever count whole rows or calls
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+def _prom_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels.values())
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+registry = Registry()
+enabled = True
+# statements slower than this many seconds are logged to the datalayer.slow logger. None turns the log off
+slow_query_threshold = float(os.environ['BANK_SLOW_QUERY_MS']) / 1000 if os.environ.get('BANK_SLOW_QUERY_MS') else None
+
+def set_registry(new_registry):
+    """
+    Sends all metrics to a different registry from now on.
+
+    Arguments:
+        new_registry: a Registry, or any object with the same incr and observe methods
+
+    Returns:
+        the previous registry
+    """
+    global registry
+    old_registry = registry
+    registry = new_registry
+    return old_registry
+
+def write(path):
+    """Writes the registry to a file: as JSON if path ends in .json, otherwise as Prometheus text"""
+    with open(path, "w") as out:
+        out.write(registry.to_json() if path.endswith(".json") else registry.to_prometheus())
+
+# BANK_METRICS_FILE dumps everything recorded to that file when the program exits
+if os.environ.get('BANK_METRICS_FILE'):
+    atexit.register(write, os.environ['BANK_METRICS_FILE'])
+
+def set_slow_query_threshold(seconds):
+    """Logs every statement slower than seconds, with its SQL and parameters. None turns the slow-query log off"""
+    global slow_query_threshold
+    slow_query_threshold = seconds
+
+def timed(layer, rows = False):
+    """
+    Decorator recording each call of a function in the registry: bank_call_seconds (a timer),
+    bank_call_errors_total when it raises, and with rows=True, bank_call_rows_total, the number of rows returned
+    (the length of a list result, otherwise 1, or 0 for None). All are labelled with the layer and the function name.
+
+    Arguments:
+        layer (str): which part of the system the function belongs to, such as 'datalayer' or 'banking'
+        rows (bool): whether to count the rows in the function's result
+    """
+    def decorator(func):
+        name = func.__name__
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                registry.incr('bank_call_errors_total', layer = layer, function = name)
+                raise
+            finally:
+                registry.observe('bank_call_seconds', time.perf_counter() - start, layer = layer, function = name)
+            if rows:
+                count = len(result) if isinstance(result, list) else int(result is not None)
+                registry.incr('bank_call_rows_total', count, layer = layer, function = name)
+            return result
+        return wrapper
+    return decorator
+
+def instrument_engine(engine):
+    """
+    Records database activity on an engine: bank_db_connections_total (new connections opened),
+    bank_db_checkouts_total (connections taken from the pool), bank_db_statement_seconds (a timer per statement),
+    and bank_db_rows_written_total (rows changed by writes). Statements slower than slow_query_threshold
+    are logged with their SQL and parameters.
+    """
+    @event.listens_for(engine, "connect")
+    def on_connect(dbapi_conn, conn_record):
+        if enabled:
+            registry.incr('bank_db_connections_total')
+
+    @event.listens_for(engine, "checkout")
+    def on_checkout(dbapi_conn, conn_record, conn_proxy):
+        if enabled:
+            registry.incr('bank_db_checkouts_total')
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start'].pop()
+        if not enabled:
+            return
+        registry.observe('bank_db_statement_seconds', elapsed)
+        if cursor.rowcount is not None and cursor.rowcount > 0 and not statement.lstrip().upper().startswith('SELECT'):
+            registry.incr('bank_db_rows_written_total', cursor.rowcount)
+        if slow_query_threshold is not None and elapsed >= slow_query_threshold:
+            registry.incr('bank_db_slow_statements_total')
+            if executemany:
+                # bulk writes can carry thousands of rows; the first is enough to identify them
+                parameters = f"{len(parameters)} rows, first {parameters[0]!r}" if parameters else parameters
+            slow_query_log.warning(f"Slow query ({elapsed * 1000:.1f} ms): {statement} -- parameters: {parameters}")
+
+    @event.listens_for(engine, "handle_error")
+    def on_error(context):
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
@@ -0,0 +1,31 @@
+"""
+Helpers for holding amounts of money exactly, as whole numbers of cents.
+Accounts, credit cards and loans keep their balances and limits in cents, and the database stores cents too;
+dollar amounts only appear at the edges, when a user types one in or a balance is displayed.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+
+def to_cents(amount):
+    """
+    Converts a dollar amount to whole cents, rounding half a cent away from zero.
+
+    Arguments:
+        amount (int, float, str or Decimal): the dollar amount. Floats are read as the decimal they display as, so 0.285 is 29 cents
+
+    Returns:
+        the amount in cents (int)
+    """
+    if isinstance(amount, int):
+        return amount * 100
+    return int((Decimal(str(amount)) * 100).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def to_decimal(cents):
+    """Converts whole cents to an exact Decimal dollar amount, for reporting and reconciliation"""
+    return Decimal(cents).scaleb(-2)
+
+def round_cents(cents):
+    """
+    Rounds a fractional number of cents, such as a balance times an interest multiplier, to whole cents.
+    Rounds half away from zero, the same as SQL ROUND, so Python and set-based SQL updates agree.
+    """
+    return int(cents + 0.5) if cents >= 0 else -int(0.5 - cents)
@@ -0,0 +1,90 @@
+# Sharded month-end runner for the simple banking system
+# Splits the customers into shards and applies each shard's monthly interest in a separate worker process,
+# each with its own database connection. Every shard commits on its own, together with a record that it is done,
+# so a run that crashes part way can simply be run again: completed shards are skipped, the rest are applied.
+# The shards only run in parallel on a server database. SQLite lets one transaction write at a time,
+# so on SQLite the workers take turns on the write lock and the run is no faster than a single process.
+#
+# Usage:
+#     python month_end.py [--workers N] [--shards N] [--period YYYY-MM] [--profile]
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import logging
+import os
+import datalayer as dl
+import profiling
+
+def _init_worker(url, profile_dir):
+    """
+    Gives each worker process its own engine, rather than connections inherited from the parent,
+    and turns on profiling mode in the worker if it is on in the parent
+    """
+    dl.engine = None
+    dl.configure_engine(url)
+    if profile_dir is not None:
+        profiling.enable(profile_dir)
+
+def _run_shard(period, shard):
+    """Runs one shard in a worker, profiled if profiling mode is on"""
+    with profiling.profiled(f"month-end-{period}-shard{shard}"):
+        return dl.month_end_shard(period, shard)
+
+def run(workers = None, shards = None, period = None):
+    """
+    Applies a month of interest to every interest-bearing account and every credit card, shard by shard.
+
+    Arguments:
+        workers (int): number of worker processes. Defaults to the number of CPUs
+        shards (int): number of shards to split the customers into, for a new plan. Defaults to 4 per worker,
+            so a slow shard doesn't hold up the whole run
+        period (str): the month-end period, as 'YYYY-MM'. Defaults to the current month
+
+    Returns:
+        a list with one dict per shard, in shard order. See datalayer.month_end_shard
+
+    Raises:
+        ValueError: period is not written as 'YYYY-MM'
+    """
+    workers = workers or os.cpu_count() or 1
+    period = period or dl.month_end_period()
+    plan = dl.plan_month_end_shards(period, shards or workers * 4)
+    # the workers open their own connections; don't hand them copies of ours
+    dl.engine.dispose()
+    results = []
+    profile_dir = profiling.output_dir if profiling.enabled else None
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(str(dl.engine.url), profile_dir)) as pool:
+        futures = [pool.submit(_run_shard, period, shard) for shard, lo, hi in plan]
+        for future in as_completed(futures):
+            result = future.result()
+            status = "already complete" if result['skipped'] else f"done in {result['seconds']:.3f}s"
+            logging.info(f"Month end {period} shard {result['shard']} (owners {result['lo']} to {result['hi']}) {status}: "
+                         f"{result['accounts']} accounts, {result['credit_cards']} credit cards")
+            results.append(result)
+    # balances changed underneath this process's lookup cache
+    dl._cache_clear()
+    return sorted(results, key=lambda result: result['shard'])
+
+if __name__ == "__main__":
+    logging.basicConfig(filename="transaction.log", level=logging.INFO,
+                        format="%(asctime)s %(message)s", datefmt="%m/%d/%Y %I:%M:%S %p")
+    parser = argparse.ArgumentParser(description="Run month-end interest in parallel shards")
+    parser.add_argument("--workers", type=int, help="worker processes (default: number of CPUs)")
+    parser.add_argument("--shards", type=int, help="shards for a new plan (default: 4 per worker)")
+    parser.add_argument("--period", help="month-end period as YYYY-MM (default: this month)")
+    parser.add_argument("--profile", action="store_true", help="profile each shard, see profiling.py")
+    args = parser.parse_args()
+    if args.profile:
+        profiling.enable()
+    try:
+        results = run(args.workers, args.shards, args.period)
+    except ValueError as err:
+        parser.error(str(err))
+    print(f"{'shard':>5} {'owners':>20} {'accounts':>9} {'paid':>12} {'cards':>9} {'charged':>12} {'seconds':>8}")
+    for result in results:
+        owners = f"{result['lo']}-{result['hi']}"
+        seconds = "skipped" if result['skipped'] else f"{result['seconds']:.3f}"
+        print(f"{result['shard']:>5} {owners:>20} {result['accounts']:>9} {result['account_interest']:>12.2f} "
+              f"{result['credit_cards']:>9} {result['credit_card_interest']:>12.2f} {seconds:>8}")
+    print(f"Month end complete: {sum(r['accounts'] for r in results)} accounts and "
+          f"{sum(r['credit_cards'] for r in results)} credit cards affected.")
@@ -0,0 +1,233 @@
+import numpy as np
+from sqlalchemy.sql import select
+import datalayer as dl
+
+# columns holding whole cents; every other numeric column is a float
+MONEY_COLUMNS = ('balance', 'limit', 'cashlimit', 'minpayment', 'monthlypmt')
+
+def _load_columns(table, names):
+    """
+    Reads whole columns of a table into NumPy arrays, in account number order.
+
+    Arguments:
+        table(Table): the table to read
+        names(list): the columns to read
+
+    Returns:
+        a dict of column name -> array
+    """
+    with dl._connect() as conn:
+        rows = conn.execute(select([table.c[name] for name in names]).order_by(table.c.acctnum)).fetchall()
+    cols = list(zip(*rows)) if rows else [()] * len(names)
+    arrays = {}
+    for name, values in zip(names, cols):
+        if isinstance(table.c[name].type, dl.DATE):
+            arrays[name] = np.array(values, dtype='datetime64[D]')
+        elif name in ('acctnum', 'owner') or name in MONEY_COLUMNS:
+            arrays[name] = np.array(values, dtype=np.int64)
+        else:
+            arrays[name] = np.array(values, dtype=np.float64)
+    return arrays
+
+def round_cents(cents):
+    """Vectorized money.round_cents: rounds fractional cents to whole cents, half away from zero"""
+    return np.where(cents >= 0, np.floor(cents + 0.5), -np.floor(0.5 - cents)).astype(np.int64)
+
+def amortization_schedules(balances, rates, payments, num_pays):
+    """
+    Computes the payment schedules of many loans at once, without looping over periods or loans.
+    The vectorized equivalent of Loan.amortization_schedule, except that amounts are not rounded to the cent
+    each period; periods after a loan is paid off are all zero.
+
+    Arguments:
+        balances (array): current balance of each loan, in cents
+        rates (array): annual interest rate of each loan, in percent
+        payments (array): monthly payment of each loan, in cents
+        num_pays (int): number of payments to compute for every loan
+
+    Returns:
+        a dict of 'payment', 'interest', 'principal', 'balance' -> array of shape (number of loans, num_pays), in cents;
+        column k is payment k + 1, and 'balance' is the remaining balance after it
+    """
+    balances, rates, payments = (np.asarray(arr, dtype=np.float64)[:, np.newaxis] for arr in (balances, rates, payments))
+    r = rates / 1200.0
+    growth = (1 + r) ** np.arange(num_pays)
+    # balance before each payment, from the closed form of balance = balance * (1 + r) - payment
+    prior = np.clip(balances * growth - payments * (growth - 1) / r, 0, None)
+    interest = prior * r
+    payment = np.minimum(payments, prior + interest)
+    principal = payment - interest
+    return {'payment': payment, 'interest': interest, 'principal': principal, 'balance': prior - principal}
+
+class Portfolio:
+    """
+    A columnar snapshot of every account, credit card and loan, held as NumPy arrays
+    so interest and projections over the whole book are computed in vectorized form.
+    Money is in cents: the balance, limit and monthlypmt arrays hold whole cents, as in the database.
+
+    Attributes:
+        accounts (dict): arrays 'acctnum', 'owner', 'balance', 'intrate' for the accounts table
+        credit_cards (dict): arrays 'acctnum', 'owner', 'balance', 'intrate', 'opendate', 'limit' for the creditcards table
+        loans (dict): arrays 'acctnum', 'owner', 'balance', 'intrate', 'opendate', 'maturitydate', 'monthlypmt' for the loans table
+
+    Methods:
+        load: Read the whole book from the database
+        accrue: Apply monthly interest to accounts and credit cards
+        project_balances: Project every balance a number of months ahead
+        total_deposits: Sum of all account balances
+        monthly_interest: Interest paid/charged in each of the coming months
+        loan_schedules: Payment schedules for every loan
+        write_back: Save the interest applied by accrue to the database
+    """
+    def __init__(self, accounts, credit_cards, loans):
+        """
+        Creates a Portfolio from column arrays. Use Portfolio.load to read one from the database.
+
+        Args:
+            accounts (dict): column name -> array for accounts
+            credit_cards (dict): column name -> array for credit cards
+            loans (dict): column name -> array for loans
+        """
+        self.accounts = accounts
+        self.credit_cards = credit_cards
+        self.loans = loans
+        # account and card balances as last loaded or written back, so write_back only saves the change since
+        self._saved = {'accounts': accounts['balance'].copy(), 'credit_cards': credit_cards['balance'].copy()}
+        # months of interest applied by accrue since then; write_back can only save one month's, for one period
+        self._unsaved_months = 0
+
+    def __repr__(self):
+        return (f'Portfolio of {len(self.accounts["acctnum"])} accounts, {len(self.credit_cards["acctnum"])} credit cards, '
+                f'{len(self.loans["acctnum"])} loans')
+
+    @classmethod
+    def load(cls):
+        """
+        Reads the accounts, creditcards and loans tables into a new Portfolio, one query per table.
+
+        Returns:
+            the new Portfolio
+        """
+        return cls(_load_columns(dl.accounts, ['acctnum', 'owner', 'balance', 'intrate']),
+                   _load_columns(dl.credit_cards, ['acctnum', 'owner', 'balance', 'intrate', 'opendate', 'limit']),
+                   _load_columns(dl.loans, ['acctnum', 'owner', 'balance', 'intrate', 'opendate', 'maturitydate', 'monthlypmt']))
+
+    def accrue(self, months = 1):
+        """
+        Applies monthly interest, compounded, to every account and credit card -- the vectorized
+        equivalent of Account.pay_interest and CreditCard.charge_interest. The rate is the annual rate / 12,
+        and balances are rounded to the cent every month
+
+        Arguments:
+            months (int): number of months of interest to apply
+
+        Returns:
+            a dict with the total interest in cents paid on accounts ('accounts') and charged on cards ('credit_cards')
+        """
+        totals = {}
+        for name, cols in (('accounts', self.accounts), ('credit_cards', self.credit_cards)):
+            multiplier = 1 + cols['intrate'] / 1200.0
+            new_bal = cols['balance']
+            for _ in range(months):
+                new_bal = round_cents(new_bal * multiplier)
+            totals[name] = int((new_bal - cols['balance']).sum())
+            cols['balance'] = new_bal
+        self._unsaved_months += months
+        return totals
+
+    def project_balances(self, months):
+        """
+        Projects every balance month by month, assuming accounts and cards only accrue interest,
+        and loans accrue interest and receive their monthly payment until paid off.
+
+        Arguments:
+            months (int): number of months to project
+
+        Returns:
+            a dict of 'accounts', 'credit_cards', 'loans' -> array of shape (months + 1, number of rows);
+            row k is the balances in (unrounded) cents after k months, so row 0 is the current balances
+        """
+        periods = np.arange(months + 1)[:, np.newaxis]
+        projected = {}
+        for name, cols in (('accounts', self.accounts), ('credit_cards', self.credit_cards)):
+            projected[name] = cols['balance'] * (1 + cols['intrate'] / 1200.0) ** periods
+        r = self.loans['intrate'] / 1200.0
+        growth = (1 + r) ** periods
+        # closed form of balance = balance * (1 + r) - payment, applied k times
+        loan_bal = self.loans['balance'] * growth - self.loans['monthlypmt'] * (growth - 1) / r
+        projected['loans'] = np.clip(loan_bal, 0, None)
+        return projected
+
+    def total_deposits(self):
+        """Sum of all account balances, in cents"""
+        return int(self.accounts['balance'].sum())
+
+    def monthly_interest(self, months = 12):
+        """
+        Interest in each of the coming months, projected as in project_balances.
+
+        Arguments:
+            months (int): number of months to project
+
+        Returns:
+            a dict of 'accounts' (interest payable by the bank), 'credit_cards' and 'loans' (interest receivable)
+            -> array with one total per month, in cents
+        """
+        projected = self.project_balances(months)
+        interest = {}
+        for name, cols in (('accounts', self.accounts), ('credit_cards', self.credit_cards), ('loans', self.loans)):
+            interest[name] = (projected[name][:-1] * (cols['intrate'] / 1200.0)).sum(axis=1)
+        return interest
+
+    def loan_schedules(self, num_pays = 360):
+        """
+        Payment schedules for every loan in the portfolio. See amortization_schedules
+
+        Arguments:
+            num_pays (int): number of payments to compute for every loan
+
+        Returns:
+            a dict of 'payment', 'interest', 'principal', 'balance' -> array of shape (number of loans, num_pays), in cents
+        """
+        return amortization_schedules(self.loans['balance'], self.loans['intrate'], self.loans['monthlypmt'], num_pays)
+
+    def write_back(self, period = None, batch_size = dl.BULK_BATCH_SIZE):
+        """
+        Saves the interest applied by accrue to the database, as month-end would: each account and card's change
+        in balance since it was loaded is added to its stored balance, with an 'interest' ledger entry, and it is
+        marked as accrued for period. Balances are never overwritten, so changes made in the database since load
+        are kept, and accounts and cards that already accrued interest for period are skipped, so it is never paid twice.
+        Afterwards the account and card balances are reloaded from the database, so the Portfolio holds what was stored,
+        rather than the interest it worked out for rows that were skipped.
+        Loans are not written; accrue doesn't change them. See datalayer.interest_bulk_apply
+
+        Arguments:
+            period (str): the month-end period the interest is for, as 'YYYY-MM'. Defaults to the current month
+            batch_size (int): Number of rows written per batch
+
+        Returns:
+            the number of accounts and cards updated
+
+        Raises:
+            ValueError: more than one month of interest has been accrued since the last write_back, so it can't all be
+                marked as accrued for one period; write back after each month instead. Also if period is not written as 'YYYY-MM'
+        """
+        if self._unsaved_months > 1:
+            raise ValueError(f"{self._unsaved_months} months of interest accrued since the last write_back, "
+                             "but only one month can be written back for a period")
+        period = period or dl.month_end_period()
+        written = 0
+        for name, table, cols in (('accounts', dl.accounts, self.accounts), ('credit_cards', dl.credit_cards, self.credit_cards)):
+            interest = cols['balance'] - self._saved[name]
+            changed = np.nonzero(interest)[0]
+            written += dl.interest_bulk_apply(table, zip(cols['acctnum'][changed].tolist(), interest[changed].tolist()),
+                                              period, batch_size)
+            stored = _load_columns(table, ['acctnum', 'balance'])
+            # both are in account number order; rows deleted since load keep their balance, rows added are ignored
+            pos = np.searchsorted(stored['acctnum'], cols['acctnum'])
+            found = pos < len(stored['acctnum'])
+            found[found] = stored['acctnum'][pos[found]] == cols['acctnum'][found]
+            cols['balance'][found] = stored['balance'][pos[found]]
+            self._saved[name] = cols['balance'].copy()
+        self._unsaved_months = 0
+        return written
@@ -0,0 +1,102 @@
+"""
+Profiling mode for the interfaces and the month-end job.
+Turn it on with the BANK_PROFILE environment variable or the --profile flag of interface_customer,
+interface_employee and month_end. Each profiled run is recorded with cProfile and leaves two files
+in BANK_PROFILE_DIR (default ./profiles): name-timestamp.prof, the raw profile for pstats or snakeviz,
+and name-timestamp.txt, a summary of where the time went -- SQLAlchemy statement compilation, SQLite execution,
+and building domain objects from rows -- followed by the top functions by cumulative time.
+"""
+from contextlib import contextmanager
+from datetime import datetime
+import cProfile
+import io
+import os
+import pstats
+
+enabled = bool(os.environ.get('BANK_PROFILE'))
+output_dir = os.environ.get('BANK_PROFILE_DIR', 'profiles')
+
+def _is_compile(filename, funcname):
+    """SQLAlchemy compiling a statement construct to SQL; ClauseElement.compile is the entry point"""
+    return funcname == 'compile' and filename.replace('\\', '/').endswith('sqlalchemy/sql/elements.py')
+
+def _is_sqlite(filename, funcname):
+    """The sqlite3 driver executing statements and fetching rows; these are C functions, with no Python callees"""
+    return filename == '~' and ("'sqlite3.Cursor'" in funcname or "'sqlite3.Connection'" in funcname)
+
+_DOMAIN_MODULES = ('accounts.py', 'services.py', 'bankpersons.py')
+
+def _is_hydration(filename, funcname):
+    """The domain classes' from_row, building Employees, Customers, Accounts, CreditCards and Loans from result rows"""
+    return funcname == 'from_row' and os.path.basename(filename) in _DOMAIN_MODULES
+
+# category -> (test for a profiled function, whether to count its cumulative rather than its own time)
+CATEGORIES = {
+    'SQLAlchemy compilation': (_is_compile, True),
+    'SQLite execution': (_is_sqlite, False),
+    'Domain object hydration': (_is_hydration, True)
+}
+
+def enable(directory = None):
+    """Turns profiling mode on, optionally writing the artifacts to directory"""
+    global enabled, output_dir
+    enabled = True
+    if directory is not None:
+        output_dir = directory
+
+def breakdown(stats:pstats.Stats):
+    """
+    Splits a profile's time into the CATEGORIES.
+
+    Returns:
+        a dict of category -> seconds, plus 'Total'
+    """
+    totals = dict.fromkeys(CATEGORIES, 0.0)
+    for (filename, lineno, funcname), (calls, prim_calls, tottime, cumtime, callers) in stats.stats.items():
+        for category, (matches, cumulative) in CATEGORIES.items():
+            if matches(filename, funcname):
+                totals[category] += cumtime if cumulative else tottime
+    totals['Total'] = stats.total_tt
+    return totals
+
+def summarize(stats:pstats.Stats, top = 30):
+    """
+    Returns:
+        the text summary of a profile: its breakdown by category, then the top functions by cumulative time
+    """
+    totals = breakdown(stats)
+    lines = ["Time by category:"]
+    for category, seconds in totals.items():
+        share = seconds / totals['Total'] * 100 if totals['Total'] else 0
+        lines.append(f"  {category:<26} {seconds:10.3f} s  {share:5.1f}%")
+    out = io.StringIO()
+    stats.stream = out
+    stats.sort_stats('cumulative').print_stats(top)
+    return '\n'.join(lines) + '\n\n' + out.getvalue()
+
+@contextmanager
+def profiled(name):
+    """
+    Profiles the code inside the block, if profiling mode is on, and writes its artifacts.
+    Does nothing otherwise.
+
+    Arguments:
+        name (str): what is being profiled; used in the artifact file names
+
+    Yields:
+        the cProfile.Profile, or None if profiling mode is off
+    """
+    if not enabled:
+        yield None
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        os.makedirs(output_dir, exist_ok = True)
+        base = os.path.join(output_dir, f"{name}-{datetime.now():%Y%m%d-%H%M%S-%f}")
+        profiler.dump_stats(base + '.prof')
+        with open(base + '.txt', 'w') as summary:
+            summary.write(summarize(pstats.Stats(profiler)))
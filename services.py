@@ -1,5 +1,10 @@
 from datetime import date
+from collections import namedtuple
 from accounts import Account
+from money import to_cents, round_cents
+
+# one payment in a Loan's amortization schedule
+ScheduleRow = namedtuple('ScheduleRow', ['period', 'payment', 'interest', 'principal', 'balance'])
 
 class Service:
     """
@@ -9,12 +14,14 @@ class Service:
         owner (int): Customer number of the person who opened the service
         acct_number (int): Account number
         open_date (date): The date on which the service was opened
-        balance (num): Balance on the service
+        balance (num): Balance on the service, in dollars
+        balance_cents (int): Balance on the service, in cents. This is what the service actually holds
         interest_rate (num): Annual interest rate on the account, in percent
 
     Methods:
         make_payment: Make a payment on the service
     """
+    __slots__ = ('owner', '_acct_number', '_balance', '_interest_rate', '_open_date')
 
     def __init__(self, owner, acct_number, balance, interest_rate, open_date = date.today()):
         """
@@ -24,12 +31,12 @@ class Service:
         owner (int): Customer number of the person who opened the service
         acct_number (int): Account number
         open_date (date): The date on which the service was opened
-        balance (num): Balance on the service
+        balance (num): Balance on the service, in dollars
         interest_rate (num): Annual interest rate on the account, in percent
         """
         self.owner = owner
         self._acct_number = acct_number
-        self._balance = balance
+        self._balance = to_cents(balance)
         self._interest_rate = interest_rate
         self._open_date = open_date
     
@@ -40,7 +47,12 @@ class Service:
 
     @property
     def balance(self):
-        """Balance on the service"""
+        """Balance on the service, in dollars"""
+        return self._balance / 100
+
+    @property
+    def balance_cents(self):
+        """Balance on the service, in cents"""
         return self._balance
     
     @property
@@ -67,15 +79,25 @@ class Service:
         Raises:
             ValueError: insufficient balance in the account, or payment amount is not positive
         """
-        if amount > account.balance:
+        cents = to_cents(amount)
+        if cents > account.balance_cents:
             raise ValueError("Insufficient funds in account for this payment")
-        if amount <= 0:
+        if cents <= 0:
             raise ValueError("Payment amount must be positive")
-        if amount > self.balance:
-            amount = self.balance
-        account.withdraw(amount)
-        self._balance -= amount
-        return self._balance
+        if cents > self._balance:
+            cents = self._balance
+        account.withdraw(cents / 100)
+        self._balance -= cents
+        return self.balance
+
+    def sync_balance(self, cents):
+        """
+        Sets the balance to what the database holds, after a change was applied there
+
+        Args:
+            cents (int): the stored balance, in cents
+        """
+        self._balance = cents
     
     @staticmethod
     def _advance_date(orig_date: date, num_years):
@@ -111,6 +133,7 @@ class CreditCard(Service):
         charge: Charge an amount to the card
         advance_cash: Pay out a cash advance against the card
     """
+    __slots__ = ('_credit_limit', '_cash_advance_limit', '_minimum_payment', '_expiration_date')
 
     def __init__(self, owner, acct_number, interest_rate, credit_limit, cash_advance_limit = 0, open_date=date.today(), minimum_payment = 25, balance = 0):
         """
@@ -129,20 +152,59 @@ class CreditCard(Service):
         super().__init__(owner, acct_number, balance, interest_rate, open_date=open_date)
         self.credit_limit = credit_limit
         self.cash_advance_limit = cash_advance_limit if cash_advance_limit != 0 else self.credit_limit / 4
-        self._minimum_payment = minimum_payment
+        self._minimum_payment = to_cents(minimum_payment)
         self._expiration_date = self._advance_date(open_date, 3)
 
+    @classmethod
+    def from_row(cls, row):
+        """
+        Builds a CreditCard from values already stored in the database, skipping the validation and
+        conversions in __init__. The expiration date is only worked out if it is asked for.
+
+        Args:
+            row (tuple): card number, owner, balance, interest rate, open date, credit limit, cash advance limit
+                and minimum payment, in the order of the creditcards table; amounts in cents
+
+        Returns:
+            the CreditCard
+        """
+        card = cls.__new__(cls)
+        (card._acct_number, card.owner, card._balance, card._interest_rate, card._open_date,
+         card._credit_limit, card._cash_advance_limit, card._minimum_payment) = row
+        card._expiration_date = None
+        return card
+
+    @property
+    def credit_limit(self):
+        """The maximum balance this card can have, in dollars"""
+        return self._credit_limit / 100
+
+    @credit_limit.setter
+    def credit_limit(self, amount):
+        self._credit_limit = to_cents(amount)
+
+    @property
+    def cash_advance_limit(self):
+        """The maximum amount of cash this card can advance to its owner, in dollars"""
+        return self._cash_advance_limit / 100
+
+    @cash_advance_limit.setter
+    def cash_advance_limit(self, amount):
+        self._cash_advance_limit = to_cents(amount)
+
     @property
     def minimum_payment(self):
         """
-        The minimum monthly payment that must be made on this CreditCard.
+        The minimum monthly payment that must be made on this CreditCard, in dollars.
         Either $25, or 10% of the current balance, whichever is greater
         """
-        return max(self._minimum_payment, self.balance / 10)
+        return max(self._minimum_payment, round_cents(self._balance / 10)) / 100
 
     @property
     def expiration_date(self):
         """The date on which this card expires"""
+        if self._expiration_date is None:
+            self._expiration_date = self._advance_date(self._open_date, 3)
         return self._expiration_date
 
     def __repr__(self):
@@ -163,10 +225,11 @@ class CreditCard(Service):
         Raises:
             ValueError: amount of charge would put the balance over the limit, decline transaction
         """
-        if self.balance + amount > self.credit_limit:
+        cents = to_cents(amount)
+        if self._balance + cents > self._credit_limit:
             raise ValueError("Transaction declined, credit limit would be breached")
-        self._balance += amount
-        return self._balance
+        self._balance += cents
+        return self.balance
 
     def advance_cash(self, amount):
         """
@@ -181,21 +244,22 @@ class CreditCard(Service):
         Raises:
             ValueError: amount of advance would put the balance over the limit, decline transaction
         """
-        if self.balance + amount > self.cash_advance_limit:
+        cents = to_cents(amount)
+        if self._balance + cents > self._cash_advance_limit:
             raise ValueError("Advance declined, cash advance limit would be breached")
-        self._balance += amount
-        return self._balance
+        self._balance += cents
+        return self.balance
 
     def charge_interest(self):
         """
-        Applies interest to the CreditCard. The rate is the annual rate / 12
+        Applies interest to the CreditCard. The rate is the annual rate / 12, and the result is rounded to the cent
 
         Returns:
             the card balance after applying interest
         """
         multiplier = 1 + self._interest_rate / 1200.0
-        self._balance *= multiplier
-        return self._balance
+        self._balance = round_cents(self._balance * multiplier)
+        return self.balance
         
 class Loan(Service):
     """
@@ -205,15 +269,18 @@ class Loan(Service):
         owner (int): Customer number of the person who opened the loan
         acct_number (int): Loan number
         open_date (date): The date on which the loan was opened
-        balance (num): Balance on the loan
+        balance (num): Balance on the loan, in dollars
+        balance_cents (int): Balance on the loan, in cents
         interest_rate (num): Annual interest rate on the loan, in percent
         maturity_date (date): The date the loan matures
-        monthly_payment (num): The required monthly payment
+        monthly_payment (num): The required monthly payment, in dollars
 
     Methods:
         make_payment: Make a payment on the loan (overridden)
         calculate_amortization: (re)Calculate the monthly payment
+        amortization_schedule: Generate the remaining payment schedule
     """
+    __slots__ = ('_maturity_date', '_monthly_pmt')
 
     def __init__(self, owner, acct_number, balance, interest_rate, open_date=date.today(), term=30, maturity_date = None, monthly_pmt = None):
         """
@@ -240,7 +307,27 @@ class Loan(Service):
             raise ValueError("Loan term must be positive")
         super().__init__(owner, acct_number, balance, interest_rate, open_date=open_date)
         self._maturity_date = maturity_date if maturity_date is not None else self._advance_date(open_date, term)
-        self._monthly_pmt = monthly_pmt if monthly_pmt is not None else self.calculate_amortization(term * 12)
+        if monthly_pmt is None:
+            monthly_pmt = self.calculate_amortization(term * 12)
+        self._monthly_pmt = to_cents(monthly_pmt)
+
+    @classmethod
+    def from_row(cls, row):
+        """
+        Builds a Loan from values already stored in the database, skipping the validation and
+        payment calculation in __init__.
+
+        Args:
+            row (tuple): loan number, owner, balance, interest rate, open date, maturity date and monthly payment,
+                in the order of the loans table; amounts in cents
+
+        Returns:
+            the Loan
+        """
+        loan = cls.__new__(cls)
+        (loan._acct_number, loan.owner, loan._balance, loan._interest_rate, loan._open_date,
+         loan._maturity_date, loan._monthly_pmt) = row
+        return loan
 
     @property
     def maturity_date(self):
@@ -248,7 +335,7 @@ class Loan(Service):
 
     @property
     def monthly_payment(self):
-        return self._monthly_pmt
+        return self._monthly_pmt / 100
 
     def __repr__(self):
         repr_str = f'Loan nbr {self.acct_number} has balance ${round(self.balance, 2)}'
@@ -264,8 +351,40 @@ class Loan(Service):
             num_pays (int): Number of payments to be made on the loan
         
         Returns:
-            the monthly payment
+            the monthly payment, in dollars (not yet rounded to the cent)
         """
         r = self._interest_rate / 1200.0
-        mp = self._balance * (r + r / ((1 + r) ** num_pays - 1))
+        mp = self.balance * (r + r / ((1 + r) ** num_pays - 1))
         return mp
+
+    def amortization_schedule(self, num_pays = None):
+        """
+        The payment schedule for this loan, starting from the current balance, generated lazily.
+        Interest is rounded to the cent each period, and the last payment is reduced to just what pays the loan off.
+
+        Arguments:
+            num_pays (int): Number of payments to generate. Defaults to every payment until the loan is paid off
+
+        Returns:
+            an iterator of ScheduleRow (period, payment, interest, principal, remaining balance), one for each monthly
+            payment, from period 1. Amounts are in dollars
+
+        Raises:
+            ValueError: num_pays is not specified, and the monthly payment doesn't cover the monthly interest.
+                This is checked when the schedule is asked for, before any row is generated
+        """
+        r = self._interest_rate / 1200.0
+        if num_pays is None and self._monthly_pmt <= round_cents(self._balance * r):
+            raise ValueError("Monthly payment does not cover the interest, this loan will never be paid off")
+        return self._schedule_rows(self._balance, r, num_pays)
+
+    def _schedule_rows(self, balance, r, num_pays):
+        """Generates the rows of amortization_schedule, from balance in cents and the monthly rate r"""
+        period = 0
+        while balance > 0 and (num_pays is None or period < num_pays):
+            period += 1
+            interest = round_cents(balance * r)
+            payment = min(self._monthly_pmt, balance + interest)
+            principal = payment - interest
+            balance -= principal
+            yield ScheduleRow(period, payment / 100, interest / 100, principal / 100, balance / 100)
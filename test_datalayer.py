@@ -0,0 +1,234 @@
+"""
+Tests for the datalayer against scratch SQLite databases: the schema migrations, rounding to the cent in SQL,
+the resumable month-end, and the lookup cache. Run with python -m pytest from this directory.
+"""
+import os
+import sqlite3
+from datetime import date
+import pytest
+
+# importing datalayer connects to BANK_DB_URL, so keep it off the real database
+os.environ.setdefault('BANK_DB_URL', 'sqlite://')
+
+import datalayer as dl
+from accounts import Account
+from bankpersons import Customer
+from money import to_cents, round_cents
+from services import CreditCard
+
+@pytest.fixture
+def db(tmp_path):
+    """A new, empty database for one test; returns its file path"""
+    path = tmp_path / 'bank.sqlite'
+    dl.configure_engine(f'sqlite:///{path}')
+    yield path
+    dl.disable_cache()
+    dl.engine.dispose()
+
+def new_customer(first_name = 'Ann', last_name = 'Lee'):
+    cust = Customer(first_name, last_name, None)
+    cust.add_contact('1 Main St', 'Springfield', 'IL', '62701', 'ann@example.com')
+    dl.customer_upsert(cust)
+    return cust
+
+def add_accounts(owner, rows):
+    """Writes savings accounts from (account number, balance in cents, interest rate) rows"""
+    dl.accounts_bulk_upsert([Account.from_row((acct_num, owner, 'savings', balance, rate)) for acct_num, balance, rate in rows])
+
+def stored(table, column = 'balance'):
+    """acctnum -> column for every row of table"""
+    with dl.engine.connect() as conn:
+        return dict(conn.execute(dl.select([table.c.acctnum, table.c[column]])).fetchall())
+
+def interest_entries(acct_num):
+    with dl.engine.connect() as conn:
+        return conn.execute(dl.select([dl.transactions.c.amount]).where(dl.and_(
+            dl.transactions.c.acctnum == acct_num, dl.transactions.c.kind == 'interest'))).fetchall()
+
+# the money tables as they were before the migrations, with dollars in REAL columns
+V0_SCHEMA = """
+CREATE TABLE employees (empid INTEGER PRIMARY KEY, firstname VARCHAR, lastname VARCHAR, address VARCHAR,
+    city VARCHAR, state VARCHAR(2), zipcode VARCHAR(5), email VARCHAR);
+CREATE TABLE customers (custid INTEGER PRIMARY KEY, firstname VARCHAR, lastname VARCHAR, address VARCHAR,
+    city VARCHAR, state VARCHAR(2), zipcode VARCHAR(5), email VARCHAR);
+CREATE TABLE accounts (acctnum INTEGER PRIMARY KEY, owner INTEGER REFERENCES customers (custid),
+    accttype VARCHAR, balance FLOAT, intrate FLOAT);
+CREATE TABLE creditcards (acctnum INTEGER PRIMARY KEY, owner INTEGER REFERENCES customers (custid),
+    balance FLOAT, intrate FLOAT, opendate DATE, "limit" FLOAT, cashlimit FLOAT, minpayment FLOAT);
+CREATE TABLE loans (acctnum INTEGER PRIMARY KEY, owner INTEGER REFERENCES customers (custid),
+    balance FLOAT, intrate FLOAT, opendate DATE, maturitydate DATE, monthlypmt FLOAT);
+"""
+
+# dollar amounts whose float product with 100 lands just under half a cent
+DOLLARS = [0.285, 1.005, 0.145, 10.29, 1234.5, 0.1 + 0.2, 99999.99, 0]
+
+def make_v0_db(path):
+    """Creates a database as the first version of the bank left it, with an account and card for each of DOLLARS"""
+    conn = sqlite3.connect(path)
+    conn.executescript(V0_SCHEMA)
+    conn.execute("INSERT INTO customers VALUES (1, 'Ann', 'Lee', '1 Main St', 'Springfield', 'IL', '62701', 'ann@example.com')")
+    for i, dollars in enumerate(DOLLARS):
+        conn.execute("INSERT INTO accounts VALUES (?, 1, 'savings', ?, 1.5)", (100 + i, dollars))
+        conn.execute("INSERT INTO creditcards VALUES (?, 1, ?, 19.9, '2020-01-01', 5000.0, 500.0, ?)", (200 + i, dollars, dollars))
+    conn.execute("INSERT INTO loans VALUES (300, 1, 10000.005, 3.5, '2020-01-01', '2050-01-01', 44.905)")
+    conn.commit()
+    conn.close()
+
+def test_migration_converts_dollars_to_cents_like_to_cents(tmp_path):
+    path = tmp_path / 'old.sqlite'
+    make_v0_db(path)
+    dl.configure_engine(f'sqlite:///{path}')
+    try:
+        expected = {100 + i: to_cents(dollars) for i, dollars in enumerate(DOLLARS)}
+        assert stored(dl.accounts) == expected
+        assert stored(dl.credit_cards) == {acct_num + 100: cents for acct_num, cents in expected.items()}
+        assert stored(dl.credit_cards, 'minpayment') == {acct_num + 100: cents for acct_num, cents in expected.items()}
+        assert stored(dl.credit_cards, 'limit') == {200 + i: 500000 for i in range(len(DOLLARS))}
+        assert stored(dl.loans) == {300: to_cents(10000.005)}
+        assert stored(dl.loans, 'monthlypmt') == {300: to_cents(44.905)}
+        with dl.engine.connect() as conn:
+            assert dl._schema_version(conn) == len(dl.MIGRATIONS)
+            assert conn.execute(dl.text("SELECT count(*) FROM balancecheckpoints")).scalar() == 2 * len(DOLLARS) + 1
+    finally:
+        dl.engine.dispose()
+
+def test_failed_migration_leaves_the_database_as_it_was(tmp_path, monkeypatch):
+    path = tmp_path / 'old.sqlite'
+    make_v0_db(path)
+    def convert_then_fail(conn):
+        dl._money_to_cents(conn)
+        raise RuntimeError("simulated crash")
+    monkeypatch.setattr(dl, 'MIGRATIONS', [convert_then_fail if step is dl._money_to_cents else step for step in dl.MIGRATIONS])
+    with pytest.raises(RuntimeError):
+        dl.configure_engine(f'sqlite:///{path}')
+    dl.engine.dispose()
+    conn = sqlite3.connect(path)
+    # only the migration before the failed one was applied, and the dollars are all still there
+    assert conn.execute("PRAGMA user_version").fetchone()[0] == 1
+    assert conn.execute("SELECT name FROM sqlite_master WHERE name LIKE '%_dollars'").fetchall() == []
+    assert dict(conn.execute("SELECT acctnum, balance FROM accounts")) == {100 + i: dollars for i, dollars in enumerate(DOLLARS)}
+    conn.close()
+    monkeypatch.undo()
+    dl.configure_engine(f'sqlite:///{path}')
+    try:
+        assert stored(dl.accounts) == {100 + i: to_cents(dollars) for i, dollars in enumerate(DOLLARS)}
+    finally:
+        dl.engine.dispose()
+
+def test_migration_resumes_a_table_left_renamed(tmp_path):
+    path = tmp_path / 'old.sqlite'
+    make_v0_db(path)
+    # as an interrupted run of the old, non-transactional migration left it: indexes added, accounts renamed
+    # and recreated, and only part of it copied
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA user_version = 1")
+    conn.execute("ALTER TABLE accounts RENAME TO accounts_dollars")
+    conn.execute("CREATE TABLE accounts (acctnum INTEGER PRIMARY KEY, owner INTEGER, accttype VARCHAR, balance INTEGER, intrate FLOAT)")
+    conn.execute("INSERT INTO accounts SELECT acctnum, owner, accttype, CAST(ROUND(balance * 100) AS INTEGER), intrate "
+                 "FROM accounts_dollars LIMIT 2")
+    conn.commit()
+    conn.close()
+    dl.configure_engine(f'sqlite:///{path}')
+    try:
+        assert stored(dl.accounts) == {100 + i: to_cents(dollars) for i, dollars in enumerate(DOLLARS)}
+        with dl.engine.connect() as conn:
+            assert not dl.engine.dialect.has_table(conn, 'accounts_dollars')
+            assert dl._schema_version(conn) == len(dl.MIGRATIONS)
+    finally:
+        dl.engine.dispose()
+
+# balances and rates where interest comes to exactly half a cent, or just either side of it
+INTEREST_CASES = [(50, 12.0), (150, 12.0), (250, 12.0), (1, 6.0), (99, 12.0), (101, 12.0), (123457, 1.5),
+                  (1000000, 2.25), (333333, 0.75), (7, 19.9), (0, 3.0), (5000, 2.4)]
+
+def test_month_end_rounds_interest_like_python(db):
+    cust = new_customer()
+    add_accounts(cust.cust_number, [(i + 1, balance, rate) for i, (balance, rate) in enumerate(INTEREST_CASES)])
+    dl.credit_cards_bulk_upsert([CreditCard.from_row((1001 + i, cust.cust_number, balance, rate, date(2020, 1, 1), 10**9, 0, 0))
+                                 for i, (balance, rate) in enumerate(INTEREST_CASES)])
+    expected = {}
+    for i, (balance, rate) in enumerate(INTEREST_CASES):
+        acct = Account.from_row((i + 1, cust.cust_number, 'savings', balance, rate))
+        acct.pay_interest()
+        expected[i + 1] = acct.balance_cents
+        assert acct.balance_cents == round_cents(balance * (1 + rate / 1200.0))
+    dl.month_end_interest('2030-01')
+    assert stored(dl.accounts) == expected
+    assert stored(dl.credit_cards) == {acct_num + 1000: cents for acct_num, cents in expected.items()}
+
+def test_month_end_is_idempotent(db):
+    cust = new_customer()
+    add_accounts(cust.cust_number, [(i + 1, 100000 + i, 2.5) for i in range(20)])
+    first = dl.month_end_interest('2030-01', batch_size = 7)
+    balances = stored(dl.accounts)
+    again = dl.month_end_interest('2030-01', batch_size = 7)
+    assert not first['already_run'] and again['already_run']
+    assert again['accounts'] == first['accounts'] == 20
+    assert stored(dl.accounts) == balances
+    assert all(len(interest_entries(acct_num)) == 1 for acct_num in balances)
+    # the next period accrues again
+    dl.month_end_interest('2030-02', batch_size = 7)
+    assert all(len(interest_entries(acct_num)) == 2 for acct_num in balances)
+
+def test_month_end_resumes_after_a_crash(db, monkeypatch):
+    cust = new_customer()
+    rows = [(i + 1, 100000 + 37 * i, 1.0 + i / 10) for i in range(25)]
+    add_accounts(cust.cust_number, rows)
+    expected = {acct_num: round_cents(balance * (1 + rate / 1200.0)) for acct_num, balance, rate in rows}
+    accrue = dl._accrue
+    calls = []
+    def crash_on_third_batch(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            raise RuntimeError("simulated crash")
+        return accrue(*args)
+    monkeypatch.setattr(dl, '_accrue', crash_on_third_batch)
+    with pytest.raises(RuntimeError):
+        dl.month_end_interest('2030-01', batch_size = 4)
+    # the two committed batches are done, and the rest are not
+    partial = stored(dl.accounts)
+    assert sum(partial[acct_num] == expected[acct_num] for acct_num in expected) == 8
+    monkeypatch.undo()
+    result = dl.month_end_interest('2030-01', batch_size = 4)
+    assert stored(dl.accounts) == expected
+    assert result['accounts'] == 25
+    assert to_cents(result['account_interest']) == sum(expected[acct_num] - balance for acct_num, balance, rate in rows)
+    assert all(len(interest_entries(acct_num)) == 1 for acct_num in expected)
+
+def test_cache_forgets_a_customers_old_name(db):
+    dl.enable_cache()
+    cust = new_customer('Ann', 'Lee')
+    dl.disable_cache()
+    dl.enable_cache()
+    # cached by name only, so the old name can't be read back from a cached row by customer number
+    assert dl.customer_srch(first_name = 'Ann', last_name = 'Lee').cust_number == cust.cust_number
+    cust.last_name = 'Kim'
+    dl.customer_upsert(cust)
+    assert dl.customer_srch(first_name = 'Ann', last_name = 'Lee') == []
+    assert dl.customer_srch(first_name = 'Ann', last_name = 'Kim').cust_number == cust.cust_number
+
+def test_cache_forgets_an_accounts_old_owner(db):
+    dl.enable_cache()
+    ann, bob = new_customer('Ann', 'Lee'), new_customer('Bob', 'Roe')
+    add_accounts(ann.cust_number, [(1, 5000, 1.5)])
+    assert [acct.acct_number for acct in dl.account_srch(cust_num = ann.cust_number)] == [1]
+    assert dl.account_srch(cust_num = bob.cust_number) == []
+    acct = dl.account_srch(acct_num = 1)[0]
+    acct.owner = bob.cust_number
+    dl.account_upsert(acct)
+    assert dl.account_srch(cust_num = ann.cust_number) == []
+    assert [acct.acct_number for acct in dl.account_srch(cust_num = bob.cust_number)] == [1]
+
+def test_cache_hands_out_copies_and_drops_balances_after_a_refused_write(db):
+    dl.enable_cache()
+    cust = new_customer()
+    add_accounts(cust.cust_number, [(1, 5000, 1.5)])
+    acct = dl.account_srch(acct_num = 1)[0]
+    acct.deposit(100)
+    assert dl.account_srch(acct_num = 1)[0].balance_cents == 5000
+    # changed behind the cache's back, then a withdrawal the stored balance can't cover
+    with dl.engine.connect() as conn:
+        conn.execute(dl.accounts.update().where(dl.accounts.c.acctnum == 1).values(balance = 1000))
+    with pytest.raises(ValueError):
+        dl.account_withdraw(acct, 20)
+    assert dl.account_srch(acct_num = 1)[0].balance_cents == 1000